@@ -9,52 +9,72 @@ Created on Wed Jan 14 11:30:29 2015
 
 @author: nico
 """
-import numpy as np
+from functools import lru_cache
 from math import factorial
 
+import numpy as np
+
+
+@lru_cache(maxsize=128)
+def _savitzky_golay_coefficients(window_size, order, deriv=0, rate=1):
+    """
+    Filter coefficients for a window size, polynomial order, derivative and sampling rate.
+    They are computed once and memoized: the returned array is read-only.
+    """
+    half_window = (window_size - 1) // 2
+    b = np.array([[k ** i for i in range(order + 1)]
+                  for k in range(-half_window, half_window + 1)], dtype=float)
+    m = np.linalg.pinv(b)[deriv] * rate ** deriv * factorial(deriv)
+    m.flags.writeable = False
+    return m
+
 
-def savitzky_golay(y, window_size, order, deriv=0, rate=1):
+def savitzky_golay(y, window_size, order, deriv=0, rate=1, axis=-1):
     """
     Smoothes input signal with a Savitzky-Golay function.
 
     Uses a kernel of size "window_size" and a polinomial fit of order "order".
+    N-D arrays are filtered along axis, all signals at once.
 
-    :param y: [description]
-    :type y: [type]
-    :param window_size: [description]
-    :type window_size: [type]
-    :param order: [description]
-    :type order: [type]
-    :param deriv: [description], defaults to 0
-    :param deriv: int, optional
-    :param rate: [description], defaults to 1
-    :param rate: int, optional
-    :raises ValueError: [description]
-    :raises TypeError: [description]
-    :raises TypeError: [description]
-    :return: [description]
-    :rtype: [type]
+    :param y: input signal(s)
+    :type y: list or numpy.array
+    :param window_size: size of the kernel, must be a positive odd number
+    :type window_size: int
+    :param order: order of the fitted polynomial, must be less than window_size - 1
+    :type order: int
+    :param deriv: order of the derivative to compute, defaults to 0 (smoothing only)
+    :type deriv: int
+    :param rate: sampling rate of the signal, scales the derivatives, defaults to 1
+    :type rate: int
+    :param axis: axis of the signals in y, defaults to -1
+    :type axis: int
+    :raises ValueError: window_size and order have to be of type int
+    :raises TypeError: window_size size must be a positive odd number
+    :raises TypeError: window_size is too small for the polynomials order
+    :return: filtered signal(s), same shape as y
+    :rtype: numpy.array
     """
-    y = np.array(y)
+    y = np.moveaxis(np.asarray(y, dtype=float), axis, -1)
 
     try:
-        window_size = np.abs(np.int(window_size))
-        order = np.abs(np.int(order))
-    except (ValueError, msg):
+        window_size = abs(int(window_size))
+        order = abs(int(order))
+    except (ValueError, TypeError):
         raise ValueError("window_size and order have to be of type int")
     if window_size % 2 != 1 or window_size < 1:
         raise TypeError("window_size size must be a positive odd number")
     if window_size < order + 2:
         raise TypeError("window_size is too small for the polynomials order")
-    order_range = range(order + 1)
     half_window = (window_size - 1) // 2
-    # precompute coefficients
-    b = np.mat([[k**i for i in order_range] for k in range(
-        -half_window, half_window + 1)])
-    m = np.linalg.pinv(b).A[deriv] * rate**deriv * factorial(deriv)
+    m = _savitzky_golay_coefficients(window_size, order, deriv, rate)
     # pad the signal at the extremes with
     # values taken from the signal itself
-    firstvals = y[0] - np.abs(y[1:half_window + 1][::-1] - y[0])
-    lastvals = y[-1] + np.abs(y[-half_window - 1:-1][::-1] - y[-1])
-    y = np.concatenate((firstvals, y, lastvals))
-    return np.convolve(m[::-1], y, mode='valid')
+    firstvals = y[..., :1] - np.abs(y[..., 1:half_window + 1][..., ::-1] - y[..., :1])
+    lastvals = y[..., -1:] + np.abs(y[..., -half_window - 1:-1][..., ::-1] - y[..., -1:])
+    y = np.concatenate((firstvals, y, lastvals), axis=-1)
+    # correlate all signals with the kernel at once, one coefficient at a time
+    n = y.shape[-1] - window_size + 1
+    out = np.zeros(y.shape[:-1] + (n,))
+    for i, c in enumerate(m):
+        out += c * y[..., i:i + n]
+    return np.moveaxis(out, -1, axis)
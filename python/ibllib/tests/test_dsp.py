@@ -0,0 +1,30 @@
+import unittest
+import numpy as np
+from ibllib.dsp import savitzky_golay
+
+
+class TestSavitzkyGolay(unittest.TestCase):
+
+    def test_polynomial(self):
+        # polynomials up to the fit order are preserved away from the edges
+        t = np.arange(100) / 10
+        y = t ** 2 - 3 * t
+        self.assertTrue(np.allclose(savitzky_golay(y, 11, 3)[5:-5], y[5:-5]))
+        yd = savitzky_golay(y, 11, 3, deriv=1, rate=10)
+        self.assertTrue(np.allclose(yd[5:-5], 2 * t[5:-5] - 3))
+
+    def test_axis(self):
+        x = np.random.randn(4, 3, 50)
+        expected = np.array([[savitzky_golay(s, 7, 2) for s in c] for c in x])
+        self.assertTrue(np.allclose(savitzky_golay(x, 7, 2), expected))
+        out = savitzky_golay(np.moveaxis(x, 2, 0), 7, 2, axis=0)
+        self.assertTrue(np.allclose(np.moveaxis(out, 0, 2), expected))
+
+    def test_errors(self):
+        self.assertRaises(TypeError, savitzky_golay, np.arange(20), 6, 2)
+        self.assertRaises(TypeError, savitzky_golay, np.arange(20), 3, 2)
+        self.assertRaises(ValueError, savitzky_golay, np.arange(20), 'a', 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,581 @@
+import unittest
+import os
+import tempfile
+import shutil
+import threading
+import functools
+import json
+import hashlib
+import gzip
+import time
+import socket
+import subprocess
+import sys
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler, SimpleHTTPRequestHandler
+
+import ibllib.webclient as wc
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """
+    Static file server supporting single byte range requests and gzip content encoding.
+    If chunked, gzip responses are sent in chunks without length, as compressed on the fly.
+    """
+    protocol_version = 'HTTP/1.1'
+    requests_log = []
+    chunked = False
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests_log.append((self.path, self.headers.get('Range')))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            content = f.read()
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        rng = self.headers.get('Range')
+        if self.headers.get('If-Range', etag) != etag:
+            # the file changed since the validator was sent: the whole file is sent
+            rng = None
+        if rng:
+            start, end = rng.replace('bytes=', '').split('-')
+            start, end = int(start), int(end) if end else len(content) - 1
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(content)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes {}-{}/{}'.format(start, end, len(content)))
+            content = content[start:end + 1]
+        else:
+            self.send_response(200)
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                content = gzip.compress(content)
+                self.send_header('Content-Encoding', 'gzip')
+                if self.chunked:
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    for i in range(0, len(content), 1000):
+                        chunk = content[i:i + 1000]
+                        self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+                    self.wfile.write(b'0\r\n\r\n')
+                    return
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class TestDownloadLocal(unittest.TestCase):
+    """
+    Download tests against a local http server serving a temporary directory
+    """
+
+    def setUp(self):
+        _QuietHandler.requests_log = []
+        _QuietHandler.chunked = False
+        self.server_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        handler = functools.partial(_QuietHandler, directory=self.server_dir)
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.server_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def _make_file(self, name, nbytes):
+        content = os.urandom(nbytes)
+        with open(os.path.join(self.server_dir, name), 'wb') as f:
+            f.write(content)
+        return self.base_url + '/' + name, content
+
+    def test_download_file_list_concurrent(self):
+        files = [self._make_file('file_{}.bin'.format(i), 1000 + i) for i in range(8)]
+        links = [f[0] for f in files]
+        file_names = wc.http_download_file_list(links, max_workers=4, verbose=False,
+                                                cache_dir=self.cache_dir)
+        # output order matches the input order
+        for fn, (_, content) in zip(file_names, files):
+            with open(fn, 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+    def test_download_file_list_errors(self):
+        link, _ = self._make_file('exists.bin', 100)
+        links = [link, self.base_url + '/does_not_exist.bin']
+        with self.assertRaises(Exception):
+            wc.http_download_file_list(links, max_workers=2, verbose=False,
+                                       cache_dir=self.cache_dir)
+        file_names, errors = wc.http_download_file_list(links, max_workers=2, verbose=False,
+                                                        cache_dir=self.cache_dir,
+                                                        return_errors=True)
+        self.assertTrue(os.path.isfile(file_names[0]) and errors[0] is None)
+        self.assertTrue(file_names[1] == '' and errors[1] is not None)
+
+    def test_download_resume(self):
+        link, content = self._make_file('big.bin', 100000)
+        file_name = wc.cached_file_name(link, cache_dir=self.cache_dir)
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        # an interrupted download leaves a part file, not a file with the final name, and the
+        # validator of the first response
+        with open(file_name + '.part', 'wb') as f:
+            f.write(content[:30000])
+        with open(file_name + '.part.json', 'w') as f:
+            json.dump({'If-Range': etag}, f)
+        self.assertEqual(wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir),
+                         file_name)
+        self.assertEqual(_QuietHandler.requests_log[-1], ('/big.bin', 'bytes=30000-'))
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(file_name + '.part'))
+        self.assertFalse(os.path.exists(file_name + '.part.json'))
+        # the file changed on the server since the first attempt: the part is not spliced
+        os.remove(file_name)
+        with open(file_name + '.part', 'wb') as f:
+            f.write(b'x' * 30000)
+        with open(file_name + '.part.json', 'w') as f:
+            json.dump({'If-Range': '"old-version"'}, f)
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        # a part without validator is downloaded again from the start
+        os.remove(file_name)
+        with open(file_name + '.part', 'wb') as f:
+            f.write(b'x' * 30000)
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir)
+        self.assertEqual(_QuietHandler.requests_log[-1], ('/big.bin', None))
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        # a part file longer than the remote file is downloaded again
+        os.remove(file_name)
+        with open(file_name + '.part', 'wb') as f:
+            f.write(content + b'toto')
+        with open(file_name + '.part.json', 'w') as f:
+            json.dump({'If-Range': etag}, f)
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_download_ranges(self):
+        link, content = self._make_file('big.bin', 100001)
+        file_name = wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                          range_workers=4, range_min_bytes=1000)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        ranges = sorted(r[1] for r in _QuietHandler.requests_log if r[1])
+        self.assertEqual(ranges, ['bytes=25001-50001', 'bytes=50002-75002',
+                                  'bytes=75003-100000'])
+        # under the size threshold the file is downloaded in a single stream
+        _QuietHandler.requests_log = []
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir, clobber=True,
+                              range_workers=4, range_min_bytes=200000)
+        self.assertEqual(len(_QuietHandler.requests_log), 1)
+
+    def test_download_checksum(self):
+        link, content = self._make_file('file.bin', 10000)
+        md5 = hashlib.md5(content).hexdigest()
+        with self.assertRaises(IOError):
+            wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                  checksum='0' * 32)
+        file_name = wc.cached_file_name(link, cache_dir=self.cache_dir)
+        self.assertFalse(os.path.exists(file_name) or os.path.exists(file_name + '.part'))
+        # the hash computed during the download is recorded in the cache index
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir, checksum=md5,
+                              cache_max_bytes=0)
+        cache = wc.DownloadCache(self.cache_dir)
+        self.assertEqual(cache.get_hash(file_name), md5)
+        # a cached file is validated against the index without being downloaded again
+        nrequests = len(_QuietHandler.requests_log)
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir, checksum=md5,
+                              cache_max_bytes=0)
+        self.assertEqual(len(_QuietHandler.requests_log), nrequests)
+        # if the expected checksum changes, the file is downloaded again and the check fails
+        with self.assertRaises(IOError):
+            wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                  checksum='0' * 32, cache_max_bytes=0)
+        self.assertEqual(len(_QuietHandler.requests_log), nrequests + 1)
+
+    def test_download_revalidate(self):
+        link, content = self._make_file('file.bin', 10000)
+        file_name = wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                          revalidate=True)
+        # unchanged on the server: conditional request answered with 304
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir, revalidate=True)
+        self.assertEqual(len(_QuietHandler.requests_log), 2)
+        self.assertEqual(wc.DownloadCache(self.cache_dir).stats()['hits'], 1)
+        # changed on the server: downloaded again
+        link, content = self._make_file('file.bin', 10000)
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir, revalidate=True)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_download_progress(self):
+        links = [self._make_file('file_{}.bin'.format(i), 3000000)[0] for i in range(3)]
+        reports = []
+        progress = wc.DownloadProgress(callback=reports.append, interval=0)
+        wc.http_download_file_list(links, max_workers=3, verbose=False,
+                                   cache_dir=self.cache_dir, progress=progress)
+        progress.close()
+        self.assertEqual(reports[-1]['bytes_done'], 9000000)
+        self.assertEqual(reports[-1]['bytes_total'], 9000000)
+        self.assertTrue(all(r['average_rate'] > 0 for r in reports))
+        # the reports are rate limited
+        reports = []
+        progress = wc.DownloadProgress(callback=reports.append, interval=3600)
+        wc.http_download_file(links[0], verbose=False, cache_dir=self.cache_dir, clobber=True,
+                              progress=progress)
+        self.assertEqual(reports, [])
+
+    def test_download_deduplication(self):
+        # files with the same name in different directories do not collide
+        for d in ('ses1', 'ses2'):
+            os.makedirs(os.path.join(self.server_dir, d))
+        link1, content1 = self._make_file('ses1/trials.choice.npy', 1000)
+        link2, content2 = self._make_file('ses2/trials.choice.npy', 1000)
+        file_names = wc.http_download_file_list([link1, link2], verbose=False,
+                                                cache_dir=self.cache_dir)
+        self.assertEqual(file_names[0], os.path.join(self.cache_dir, 'ses1', 'trials.choice.npy'))
+        with open(file_names[1], 'rb') as f:
+            self.assertEqual(f.read(), content2)
+        # concurrent requests of the same file share one transfer, even with clobber
+        link, content = self._make_file('big.bin', 3000000)
+        file_names = wc.http_download_file_list([link] * 8, max_workers=8, verbose=False,
+                                                cache_dir=self.cache_dir, clobber=True)
+        self.assertEqual(len(set(file_names)), 1)
+        self.assertEqual([r[0] for r in _QuietHandler.requests_log].count('/big.bin'), 1)
+
+    def test_cache_lock(self):
+        file_name = os.path.join(self.cache_dir, 'file.bin')
+        lock = wc.CacheLock(file_name, cache_dir=self.cache_dir, stale_after=0.3)
+        self.assertFalse(lock.acquire())
+        # the lock is touched by its owner and does not become stale
+        time.sleep(0.6)
+        with self.assertRaises(TimeoutError):
+            wc.CacheLock(file_name, cache_dir=self.cache_dir, stale_after=0.3,
+                         poll_interval=0.05, timeout=0.2).acquire()
+        lock.release()
+        self.assertFalse(os.path.exists(lock.lock_file))
+        # the lock of a process that does not exist anymore is broken
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        proc.wait()
+        with open(lock.lock_file, 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': proc.pid}, f)
+        with wc.CacheLock(file_name, cache_dir=self.cache_dir, timeout=1) as lock2:
+            self.assertTrue(lock2.waited)
+        # the lock of another host is broken once it has not been touched for stale_after
+        with open(lock.lock_file, 'w') as f:
+            json.dump({'host': 'other_host', 'pid': 1}, f)
+        with self.assertRaises(TimeoutError):
+            wc.CacheLock(file_name, cache_dir=self.cache_dir, timeout=0.2).acquire()
+        os.utime(lock.lock_file, (time.time() - 120, time.time() - 120))
+        with wc.CacheLock(file_name, cache_dir=self.cache_dir, timeout=1) as lock2:
+            self.assertTrue(lock2.waited)
+        self.assertEqual(os.listdir(os.path.dirname(lock.lock_file)), [])
+
+    def test_download_gzip(self):
+        content = b'0123456789' * 100000
+        with open(os.path.join(self.server_dir, 'file.npy'), 'wb') as f:
+            f.write(content)
+        reports = []
+        progress = wc.DownloadProgress(callback=reports.append, interval=0)
+        file_name = wc.http_download_file(self.base_url + '/file.npy', verbose=False,
+                                          cache_dir=self.cache_dir, accept_gzip=True,
+                                          progress=progress,
+                                          checksum=hashlib.md5(content).hexdigest())
+        progress.close()
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        # the compressed bytes are transferred
+        self.assertTrue(reports[-1]['bytes_total'] < len(content) / 10)
+        # a file with a compression suffix is cached as stored on the server by default
+        compressed = gzip.compress(content)
+        with open(os.path.join(self.server_dir, 'file2.npy.gz'), 'wb') as f:
+            f.write(compressed)
+        link = self.base_url + '/file2.npy.gz'
+        md5 = hashlib.md5(compressed).hexdigest()
+        file_name = wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                          checksum=md5)
+        self.assertEqual(file_name, os.path.join(self.cache_dir, 'file2.npy.gz'))
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), compressed)
+        # if decompressed, it is cached without the suffix and the checksum is the one of the
+        # stored file
+        file_name = wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                          checksum=md5, decompress=True)
+        self.assertEqual(file_name, os.path.join(self.cache_dir, 'file2.npy'))
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        nrequests = len(_QuietHandler.requests_log)
+        wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir, checksum=md5,
+                              decompress=True)
+        self.assertEqual(len(_QuietHandler.requests_log), nrequests)
+        # a truncated compressed file is not cached
+        with open(os.path.join(self.server_dir, 'file3.npy.gz'), 'wb') as f:
+            f.write(compressed[:500])
+        with self.assertRaises(IOError):
+            wc.http_download_file(self.base_url + '/file3.npy.gz', verbose=False,
+                                  cache_dir=self.cache_dir, decompress=True)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'file3.npy.part')))
+
+    def test_download_gzip_chunked(self):
+        # a stream compressed on the fly has no length: it is read until its end
+        _QuietHandler.chunked = True
+        content = b'0123456789' * 100000
+        with open(os.path.join(self.server_dir, 'file.npy'), 'wb') as f:
+            f.write(content)
+        reports = []
+        progress = wc.DownloadProgress(callback=reports.append, interval=0)
+        file_name = wc.http_download_file(self.base_url + '/file.npy', verbose=False,
+                                          cache_dir=self.cache_dir, accept_gzip=True,
+                                          progress=progress, range_workers=4,
+                                          range_min_bytes=1000,
+                                          checksum=hashlib.md5(content).hexdigest())
+        progress.close()
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertTrue(0 < reports[-1]['bytes_done'] < len(content) / 10)
+
+    def test_cache_eviction(self):
+        links = [self._make_file('file_{}.bin'.format(i), 1000)[0] for i in range(4)]
+        file_names = [wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                            cache_max_bytes=2500) for link in links[:2]]
+        cache = wc.DownloadCache(self.cache_dir, max_bytes=2500)
+        cache.pin(file_names[0])
+        # hit on the second file, then 2 more downloads: the quota leaves room for 2 files
+        wc.http_download_file(links[1], verbose=False, cache_dir=self.cache_dir,
+                              cache_max_bytes=2500)
+        for link in links[2:]:
+            file_names.append(wc.http_download_file(link, verbose=False,
+                                                    cache_dir=self.cache_dir,
+                                                    cache_max_bytes=2500))
+        exists = [os.path.exists(fn) for fn in file_names]
+        # the pinned file and the last download remain
+        self.assertEqual(exists, [True, False, False, True])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 4, 2000))
+        self.assertEqual(stats['hit_rate'], 0.2)
+
+    def test_cache_index_unavailable(self):
+        # a cache hit does not need to write the index, for example in a read-only cache
+        link, content = self._make_file('file.bin', 1000)
+        md5 = hashlib.md5(content).hexdigest()
+        file_name = wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                          cache_max_bytes=0, checksum=md5)
+        index_file = os.path.join(self.cache_dir, wc.DownloadCache.INDEX_FILE)
+        os.remove(index_file)
+        os.mkdir(index_file)
+        nrequests = len(_QuietHandler.requests_log)
+        self.assertEqual(wc.http_download_file(link, verbose=False, cache_dir=self.cache_dir,
+                                               cache_max_bytes=0, checksum=md5), file_name)
+        self.assertEqual(len(_QuietHandler.requests_log), nrequests)
+
+    def test_cache_processes(self):
+        # processes sharing the cache directory do not lose each other's index updates
+        script = ('import os, sys\n'
+                  'import ibllib.webclient as wc\n'
+                  'cache = wc.DownloadCache(sys.argv[1])\n'
+                  'for i in range(20):\n'
+                  '    fn = os.path.join(sys.argv[1], sys.argv[2] + str(i))\n'
+                  '    open(fn, "w").write("a" * 10)\n'
+                  '    cache.record(fn, hit=False)\n'
+                  '    cache.record(fn, hit=True)\n')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(wc.__file__)))
+        procs = [subprocess.Popen([sys.executable, '-c', script, self.cache_dir, str(i) + '_'],
+                                  env=env) for i in range(4)]
+        self.assertEqual([p.wait() for p in procs], [0] * 4)
+        stats = wc.DownloadCache(self.cache_dir).stats()
+        self.assertEqual((stats['n_files'], stats['size']), (80, 800))
+        self.assertEqual((stats['hits'], stats['misses']), (80, 80))
+
+
+class _AlyxHandler(BaseHTTPRequestHandler):
+    """
+    Minimal Alyx REST API: auth-token and a /flaky endpoint failing on the first request
+    """
+    protocol_version = 'HTTP/1.1'
+    requests_count = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.requests_count[self.path] = self.requests_count.get(self.path, 0) + 1
+        if self.path == '/auth-token':
+            self._send_json({'token': 'abcd'})
+        elif self.path == '/single':
+            # accepts a list but answers with a single record
+            self._send_json({'name': 'toto'}, status=201)
+        elif self.path in ('/datasets', '/files'):
+            # creates records, records named 'fail' are rejected
+            data = json.loads(body)
+            records = data if isinstance(data, list) else [data]
+            if any(r.get('name') == 'fail' for r in records):
+                self._send_json({'detail': 'bad request'}, status=400)
+                return
+            out = [dict(r, url=self.path + '/' + str(r.get('name'))) for r in records]
+            self._send_json(out if isinstance(data, list) else out[0], status=201)
+        else:
+            self._send_json({'detail': 'unavailable'}, status=503)
+
+    def do_GET(self):
+        self.requests_count[self.path] = self.requests_count.get(self.path, 0) + 1
+        if self.headers.get('Authorization') != 'Token abcd':
+            self._send_json({'detail': 'Invalid token.'}, status=401)
+        elif self.path == '/large':
+            self._send_json([{'name': 'toto', 'number': i, 'tags': ['a', 'é']}
+                             for i in range(1000)])
+        elif self.path == '/flaky' and self.requests_count[self.path] == 1:
+            self._send_json({'detail': 'unavailable'}, status=503)
+        else:
+            self._send_json([{'name': 'toto'}])
+
+
+class TestAlyxClientLocal(unittest.TestCase):
+
+    def setUp(self):
+        _AlyxHandler.requests_count = {}
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _AlyxHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.ac = wc.AlyxClient(username='toto', password='titi', base_url=self.base_url,
+                                backoff_factor=0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry(self):
+        # GET requests are retried on 5xx responses, POST requests are not
+        self.assertEqual(self.ac.get('/flaky'), [{'name': 'toto'}])
+        self.assertEqual(_AlyxHandler.requests_count['/flaky'], 2)
+        self.assertEqual(self.ac.post('/flaky_post', data={}).status_code, 503)
+        self.assertEqual(_AlyxHandler.requests_count['/flaky_post'], 1)
+
+    def test_token_file(self):
+        with tempfile.TemporaryDirectory() as td:
+            token_file = os.path.join(td, 'token.json')
+            ac = wc.AlyxClient(username='toto', password='titi', base_url=self.base_url,
+                               token_file=token_file)
+            self.assertEqual(os.stat(token_file).st_mode & 0o777, 0o600)
+            # the next client reuses the saved token without authenticating
+            ac = wc.AlyxClient(username='toto', password='titi', base_url=self.base_url,
+                               token_file=token_file)
+            self.assertEqual(_AlyxHandler.requests_count['/auth-token'], 2)
+            # a rejected token is replaced and the request sent again
+            with open(token_file, 'w') as f:
+                json.dump({self.base_url + ' toto': 'expired'}, f)
+            ac = wc.AlyxClient(username='toto', password='titi', base_url=self.base_url,
+                               token_file=token_file)
+            self.assertEqual(ac.get('/users'), [{'name': 'toto'}])
+            self.assertEqual(_AlyxHandler.requests_count['/auth-token'], 3)
+            with open(token_file) as f:
+                self.assertEqual(json.load(f)[self.base_url + ' toto'], 'abcd')
+
+    def test_get_stream(self):
+        records = list(self.ac.get_stream('/large', chunk_size=7))
+        self.assertEqual(records, self.ac.get('/large'))
+        # chunk boundaries within numbers, strings and literals
+        doc = json.dumps([1234, -5.5e3, 'a, ]b', True, None, {'k': [1, {}]}, []])
+        for n in range(1, 9):
+            chunks = [doc[i:i + n] for i in range(0, len(doc), n)]
+            self.assertEqual(list(wc.iter_json_list(chunks)), json.loads(doc))
+        self.assertEqual(list(wc.iter_json_list(['{"a"', ': 1}'])), [{'a': 1}])
+        self.assertEqual(list(wc.iter_json_list([' [ ', ' ] '])), [])
+        with self.assertRaises(ValueError):
+            list(wc.iter_json_list(['[1, 2']))
+
+    def test_register_datasets(self):
+        datasets = [{'name': 'ds{}'.format(i), 'file_records': [{'name': 'fr{}'.format(i)}]}
+                    for i in range(10)]
+        datasets[3]['name'] = 'fail'
+        datasets[5]['file_records'].append({'name': 'fail'})
+        created, errors = wc.register_datasets(self.ac, datasets, max_workers=4, batch_size=4)
+        failed = [i for i, e in enumerate(errors) if e is not None]
+        self.assertEqual(failed, [3, 5])
+        self.assertTrue(created[3] is None and created[0]['url'] == '/datasets/ds0')
+        # 3 batches of datasets, the batch with the failure is posted again item by item
+        self.assertEqual(_AlyxHandler.requests_count['/datasets'], 3 + 4)
+        # a batch accepted with an unexpected response is not posted again
+        created, errors = self.ac.post_many('/single', [{'name': str(i)} for i in range(6)],
+                                            batch_size=3)
+        self.assertTrue(all(c is None for c in created) and all(errors))
+        self.assertEqual(_AlyxHandler.requests_count['/single'], 2)
+        # nor is a batch failing on the server side
+        created, errors = self.ac.post_many('/unavailable', [{}, {}, {}], batch_size=3)
+        self.assertTrue(all(errors))
+        self.assertEqual(_AlyxHandler.requests_count['/unavailable'], 1)
+
+    def test_response_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            ac = wc.AlyxClient(username='toto', password='titi', base_url=self.base_url,
+                               cache_dir=cache_dir)
+            ac.get('/users?b=1&a=2')
+            # same normalized query: served from memory, then from disk by another client
+            ac.get(self.base_url + '/users/?a=2&b=1')
+            ac2 = wc.AlyxClient(username='toto', password='titi', base_url=self.base_url,
+                                cache_dir=cache_dir)
+            ac2.get('/users?a=2&b=1')
+            self.assertEqual(_AlyxHandler.requests_count['/users?b=1&a=2'], 1)
+            # bypass flag
+            ac.get('/users?b=1&a=2', use_cache=False)
+            self.assertEqual(_AlyxHandler.requests_count['/users?b=1&a=2'], 2)
+            # a post on the resource invalidates its cached responses in both tiers
+            ac.post('/users', data={})
+            ac.get('/users?b=1&a=2')
+            ac2.post('/users', data={})
+            ac2.get('/users?b=1&a=2')
+            self.assertEqual(_AlyxHandler.requests_count['/users?b=1&a=2'], 4)
+            # endpoints without time to live are not cached
+            ac.get('/flaky')
+            ac.get('/flaky')
+            self.assertEqual(_AlyxHandler.requests_count['/flaky'], 3)
+            # the disk tier is shared by clients of different servers
+            key = wc.ResponseCache.key('/users?a=2', 'toto', self.base_url)
+            self.assertNotEqual(key, wc.ResponseCache.key('/users?a=2', 'toto',
+                                                          'http://127.0.0.1:1'))
+            self.assertEqual(wc.ResponseCache._endpoint(key), '/users')
+            # an unusable disk tier does not fail the request
+            not_a_dir = os.path.join(cache_dir, 'file')
+            open(not_a_dir, 'w').close()
+            cache = wc.ResponseCache(cache_dir=not_a_dir)
+            cache.set(key, [{'name': 'toto'}])
+            self.assertEqual(cache.get(key), [{'name': 'toto'}])
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
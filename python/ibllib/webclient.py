@@ -1,28 +1,318 @@
 import urllib.request
+import urllib.error
+import urllib.parse
 import os
+import glob
+import time
+import hashlib
+import zlib
+import bz2
+import lzma
+import shutil
+import copy
+import collections
+import threading
+import asyncio
+import functools
+import codecs
+import contextlib
+import socket
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import requests
+from urllib3.util.retry import Retry
 import json
 
 
-def http_download_file_list(links_to_file_list, **kwargs):
+def http_download_file_list(links_to_file_list, max_workers=1, return_errors=False,
+                            checksums=None, **kwargs):
     """
     Downloads a list of files from the flat Iron from a list of links.
     Same options behaviour as http_download_file
 
     :param links_to_file_list: list of http links to files.
     :type links_to_file_list: list
+    :param max_workers: [1] number of concurrent downloads. Output order always matches the
+     input links order.
+    :type max_workers: int
+    :param return_errors: [False] if True, a failed download does not raise: its file name
+     is set to '' and the exception is returned in a second list.
+    :type return_errors: bool
+    :param checksums: [None] list of expected checksums matching the links, see the checksum
+     parameter of http_download_file. Items may be None.
+    :type checksums: list
 
     :return: (list) a list of the local full path of the downloaded files.
+     If return_errors, also a list of exceptions (None for successful downloads).
     """
-    file_names_list = []
-    for link_str in links_to_file_list:
-        file_names_list.append(http_download_file(link_str, **kwargs))
+    def _download(link_str, checksum):
+        try:
+            return http_download_file(link_str, checksum=checksum, **kwargs), None
+        except Exception as e:
+            if not return_errors:
+                raise
+            return '', e
+
+    checksums = checksums or [None] * len(links_to_file_list)
+    if max_workers > 1 and len(links_to_file_list) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_download, links_to_file_list, checksums))
+    else:
+        results = [_download(link_str, checksum)
+                   for link_str, checksum in zip(links_to_file_list, checksums)]
+    file_names_list = [r[0] for r in results]
+    if return_errors:
+        return file_names_list, [r[1] for r in results]
     return file_names_list
 
 
+def get_cache_dir(cache_dir=''):
+    """
+    :param cache_dir: [''] directory in which files are cached; defaults to user's
+     Download directory.
+    :type cache_dir: str
+
+    :return: (str) the cache directory
+    """
+    # default cache directory is the home dir
+    if len(cache_dir) == 0:
+        cache_dir = str(Path.home()) + os.sep + "Downloads"
+    return cache_dir
+
+
+# files served with these suffixes are decompressed in the cache, without the suffix, by
+# http_download_file(decompress=True)
+COMPRESSED_SUFFIXES = {
+    '.gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    '.bz2': bz2.BZ2Decompressor,
+    '.xz': lzma.LZMADecompressor,
+}
+
+
+def _compressed_suffix(full_link_to_file):
+    suffix = os.path.splitext(urllib.parse.urlsplit(full_link_to_file).path)[1]
+    return suffix if suffix in COMPRESSED_SUFFIXES else ''
+
+
+def cached_file_name(full_link_to_file, cache_dir='', decompress=False):
+    """
+    Local full path of a file once downloaded by http_download_file. Does not check
+    whether the file exists. The cache directory mirrors the path of the url so that files
+    with the same name in different sessions do not collide, for example:
+    http://ibl.flatironinstitute.org/Subjects/MW49/2018-05-11/1/_ibl_trials.choice.npy is
+    cached as <cache_dir>/Subjects/MW49/2018-05-11/1/_ibl_trials.choice.npy
+
+    :param full_link_to_file: http link to the file.
+    :type full_link_to_file: str
+    :param cache_dir: [''] directory in which files are cached; defaults to user's
+     Download directory.
+    :type cache_dir: str
+    :param decompress: [False] if True, the name of the file as cached decompressed by
+     http_download_file: without its compression suffix
+    :type decompress: bool
+
+    :return: (str) the local full path of the file
+    """
+    path = urllib.parse.unquote(urllib.parse.urlsplit(full_link_to_file).path)
+    # the url path can not point outside of the cache directory
+    parts = [p for p in path.split('/') if p not in ('', '.', '..')]
+    suffix = _compressed_suffix(full_link_to_file) if decompress else ''
+    if suffix:
+        parts[-1] = parts[-1][:-len(suffix)]
+    return os.path.join(get_cache_dir(cache_dir), *parts)
+
+
+# in process locks of the files being downloaded, with the number of threads using them
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _download_lock(file_name, cache_dir=''):
+    """
+    Context manager serializing the downloads of a cached file: between threads with a lock
+    per file and between processes with a CacheLock.
+
+    :return: yields True if another download of the file had to be waited for
+    """
+    with _file_locks_lock:
+        entry = _file_locks.setdefault(file_name, [threading.Lock(), 0])
+        entry[1] += 1
+    waited = not entry[0].acquire(blocking=False)
+    if waited:
+        entry[0].acquire()
+    try:
+        with CacheLock(file_name, cache_dir=cache_dir) as lock:
+            yield waited or lock.waited
+    finally:
+        entry[0].release()
+        with _file_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _file_locks[file_name]
+
+
+class CacheLock:
+    """
+    Lock file of a cache entry, shared by the processes using the cache directory, including
+    processes on several hosts of a shared file system.
+
+    The lock file is created atomically in the .locks directory of the cache and records the
+    host and process id of its owner. It is touched periodically while held. A lock is stale,
+    and broken by the next process waiting for it, if its owner process does not exist anymore
+    on this host or if it has not been touched for stale_after seconds, for example after a
+    crash on another host.
+
+        with CacheLock(file_name, cache_dir) as lock:
+            if not lock.waited: ...
+    """
+    LOCK_DIR = '.locks'
+
+    def __init__(self, file_name, cache_dir='', stale_after=60., poll_interval=0.1,
+                 timeout=None):
+        """
+        :param file_name: local full path of the cached file
+        :type file_name: str
+        :param cache_dir: [''] cache directory, defaults to user's Download directory.
+        :type cache_dir: str
+        :param stale_after: [60.] time in seconds after which a lock that has not been touched
+         is considered stale. The owner touches it every stale_after / 3 seconds.
+        :type stale_after: float
+        :param poll_interval: [0.1] time in seconds between 2 attempts to take the lock
+        :type poll_interval: float
+        :param timeout: [None] maximum waiting time in seconds before raising a TimeoutError,
+         wait indefinitely if None
+        :type timeout: float
+        """
+        self.lock_file = os.path.join(get_cache_dir(cache_dir), self.LOCK_DIR,
+                                      hashlib.sha1(file_name.encode()).hexdigest() + '.lock')
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.waited = False
+        self._content = None
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self):
+        """
+        Waits for the lock, breaking it if stale.
+
+        :return: True if the lock was held by another process and had to be waited for
+        """
+        os.makedirs(os.path.dirname(self.lock_file), exist_ok=True)
+        self.waited = False
+        t0 = time.time()
+        while not self._create():
+            self.waited = True
+            if self._break_stale():
+                continue
+            if self.timeout is not None and time.time() - t0 > self.timeout:
+                raise TimeoutError('Timeout waiting for the lock file ' + self.lock_file)
+            time.sleep(self.poll_interval)
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._touch, daemon=True)
+        self._heartbeat.start()
+        return self.waited
+
+    def release(self):
+        self._stop.set()
+        self._heartbeat.join()
+        # the lock may have been broken as stale and taken by another process meanwhile
+        if self._read() == self._content:
+            try:
+                os.remove(self.lock_file)
+            except FileNotFoundError:
+                pass
+
+    def _create(self):
+        content = json.dumps({'host': socket.gethostname(), 'pid': os.getpid(),
+                              'thread': threading.get_ident(), 'time': time.time()})
+        try:
+            fd = os.open(self.lock_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        self._content = content
+        return True
+
+    def _read(self):
+        try:
+            with open(self.lock_file) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _touch(self):
+        while not self._stop.wait(self.stale_after / 3):
+            try:
+                os.utime(self.lock_file)
+            except OSError:
+                pass
+
+    def _is_stale(self, content, mtime):
+        if time.time() - mtime > self.stale_after:
+            return True
+        try:
+            owner = json.loads(content)
+        except ValueError:
+            # the owner is writing the lock file
+            return False
+        if os.name != 'posix' or owner['host'] != socket.gethostname():
+            return False
+        try:
+            os.kill(owner['pid'], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def _break_stale(self):
+        """
+        :return: True if the lock file was removed, either broken as stale or released
+        """
+        try:
+            mtime = os.path.getmtime(self.lock_file)
+        except FileNotFoundError:
+            return True
+        content = self._read()
+        if content is None:
+            return True
+        if not self._is_stale(content, mtime):
+            return False
+        # renaming is atomic: a single waiting process breaks the lock
+        stale_file = '{}.{}.{}.stale'.format(self.lock_file, socket.gethostname(), os.getpid())
+        try:
+            os.rename(self.lock_file, stale_file)
+        except FileNotFoundError:
+            return True
+        with open(stale_file) as f:
+            renewed = f.read() != content
+        if renewed:
+            # the lock was released and taken again meanwhile: put it back
+            try:
+                os.link(stale_file, self.lock_file)
+            except OSError:
+                pass
+        os.remove(stale_file)
+        return True
+
+
 def http_download_file(full_link_to_file, *, clobber=False,
-                       username='', password='', cache_dir='', verbose=True):
+                       username='', password='', cache_dir='', verbose=True,
+                       cache_max_bytes=None, range_workers=1, range_min_bytes=64 * 1024 ** 2,
+                       checksum=None, hash_name='md5', revalidate=False, progress=None,
+                       accept_gzip=False, decompress=False):
     """
     :param full_link_to_file: http link to the file.
     :type full_link_to_file: str
@@ -37,22 +327,91 @@ def http_download_file(full_link_to_file, *, clobber=False,
     :type cache_dir: str
     :param verbose: [True] displays a message for each download.
     :type verbose: bool
+    :param cache_max_bytes: [None] if not None, accesses are recorded in the DownloadCache
+     index of the cache directory and, if > 0, least recently used files are evicted after
+     the download to keep the cache size under this quota.
+    :type cache_max_bytes: int
+    :param range_workers: [1] if > 1, files of at least range_min_bytes are split in
+     range_workers byte ranges downloaded over concurrent connections, when the server
+     supports range requests.
+    :type range_workers: int
+    :param range_min_bytes: [64MB] size under which files are downloaded in a single stream
+    :type range_min_bytes: int
+    :param checksum: [None] expected hexadecimal digest of the file as stored on the server,
+     for example the md5 of the Alyx file record. A download that does not match raises an
+     IOError and a cached file that does not match is downloaded again.
+    :type checksum: str
+    :param hash_name: ['md5'] hashlib algorithm of the checksum, example: 'sha1'
+    :type hash_name: str
+    :param revalidate: [False] if True, a cached file is revalidated with a conditional
+     request using the ETag and Last-Modified values recorded in the cache index at download
+     time, and downloaded again only if it changed on the server.
+    :type revalidate: bool
+    :param progress: [None] DownloadProgress to report to, for example shared by several
+     downloads. If None and verbose, the progress of this download is printed at most once
+     per second.
+    :type progress: DownloadProgress
+    :param accept_gzip: [False] if True, asks the server for a gzip compressed transfer
+     (Accept-Encoding). Compressed responses are decompressed while writing to the cache and
+     are not split in ranges. Responses without length are read until the end of the stream.
+    :type accept_gzip: bool
+    :param decompress: [False] if True, files with a suffix of COMPRESSED_SUFFIXES are
+     decompressed while downloading and cached without their suffix. The checksum is the one
+     of the compressed file as stored on the server, and is recorded in the cache index.
+     Such downloads are not resumed nor split in ranges.
+    :type decompress: bool
 
     :return: (str) a list of the local full path of the downloaded files.
     """
     if not full_link_to_file:
         return ''
 
-    # default cache directory is the home dir
-    if len(cache_dir) == 0:
-        cache_dir = str(Path.home()) + os.sep + "Downloads"
-
     # This is the local file name
-    file_name = cache_dir + os.sep + os.path.basename(full_link_to_file)
+    file_name = cached_file_name(full_link_to_file, cache_dir=cache_dir, decompress=decompress)
+    cache = None if cache_max_bytes is None else DownloadCache(cache_dir, cache_max_bytes)
+    if cache is None and (revalidate or (decompress and _compressed_suffix(full_link_to_file))):
+        # validators, and the hashes of the compressed files, are stored in the cache index
+        cache = DownloadCache(cache_dir)
+    # files are moved to the cache once complete: a cache hit does not need the lock
+    if not (clobber or revalidate) and _is_cached(cache, file_name, checksum, hash_name):
+        if cache:
+            cache.record(file_name, url=full_link_to_file, hit=True)
+        return file_name
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    # concurrent requests of a file, by threads or processes, share a single transfer: the
+    # others wait and find the file in the cache
+    with _download_lock(file_name, cache_dir) as waited:
+        if waited:
+            clobber = revalidate = False
+        return _download_file(full_link_to_file, file_name, clobber=clobber, username=username,
+                              password=password, cache=cache, verbose=verbose,
+                              range_workers=range_workers, range_min_bytes=range_min_bytes,
+                              checksum=checksum, hash_name=hash_name, revalidate=revalidate,
+                              progress=progress, accept_gzip=accept_gzip,
+                              decompress=decompress)
+
+
+def _is_cached(cache, file_name, checksum, hash_name):
+    # the checksum of a cached file is looked up in the cache index rather than computed again
+    return os.path.exists(file_name) and (
+        checksum is None or _cached_file_hash(cache, file_name, hash_name) == checksum)
 
+
+def _download_file(full_link_to_file, file_name, clobber, username, password, cache, verbose,
+                   range_workers, range_min_bytes, checksum, hash_name, revalidate, progress,
+                   accept_gzip, decompress):
+    """
+    Downloads a file to its cache location, see http_download_file
+    """
     # do not overwrite an existing file unless specified
-    if not clobber and os.path.exists(file_name):
-        return file_name
+    headers = {}
+    if not clobber:
+        if _is_cached(cache, file_name, checksum, hash_name):
+            if not revalidate:
+                if cache:
+                    cache.record(file_name, url=full_link_to_file, hit=True)
+                return file_name
+            headers = cache.get_validators(file_name)
 
     # This should be the base url you wanted to access.
     baseurl = os.path.split(full_link_to_file)[0]
@@ -65,33 +424,535 @@ def http_download_file(full_link_to_file, *, clobber=False,
     # Create an authentication handler using the password manager
     auth = urllib.request.HTTPBasicAuthHandler(manager)
 
-    # Create an opener that will replace the default urlopen method on further calls
+    # Use a local opener rather than installing a global one so that concurrent downloads
+    # in separate threads do not step on each other
     opener = urllib.request.build_opener(auth)
-    urllib.request.install_opener(opener)
+
+    # Download in a .part file first, resuming from the bytes already on disk if any.
+    # A conditional request always starts from scratch, and so does a decompressed download
+    # as the part file offset does not match the compressed stream. The resumed range is
+    # requested with the validator of the first attempt (If-Range): if the file changed on
+    # the server, it is sent whole and the part is overwritten. A part without validator is
+    # not resumed.
+    part_file = file_name + '.part'
+    validator_file = part_file + '.json'
+    suffix = _compressed_suffix(full_link_to_file) if decompress else ''
+    offset = 0
+    request_headers = dict(headers)
+    if os.path.exists(part_file) and not headers and not suffix:
+        if_range = _read_range_validator(validator_file)
+        if if_range:
+            offset = os.path.getsize(part_file)
+            request_headers['If-Range'] = if_range
+    if accept_gzip and not offset:
+        request_headers['Accept-Encoding'] = 'gzip'
 
     # Open the url and get the length
-    u = urllib.request.urlopen(full_link_to_file)
-    file_size = int(u.getheader('Content-length'))
+    try:
+        u, offset = _urlopen_range(opener, full_link_to_file, offset, headers=request_headers)
+    except urllib.error.HTTPError as e:
+        if e.code != 304 or not headers:
+            raise
+        # not modified: the cached file is up to date
+        cache.record(file_name, url=full_link_to_file, hit=True)
+        return file_name
+    # the length is unknown for streams compressed on the fly and sent in chunks
+    content_length = u.getheader('Content-length')
+    file_size = None if content_length is None else offset + int(content_length)
+    # the content encoding is removed before hashing, so that the checksum is the one of the
+    # file as stored on the server, while the compression suffix is removed after hashing
+    decoder = decompressor = None
+    if u.getheader('Content-Encoding', 'identity') == 'gzip':
+        decoder = COMPRESSED_SUFFIXES['.gz']()
+    if suffix:
+        decompressor = COMPRESSED_SUFFIXES[suffix]()
+
+    if not offset:
+        _write_range_validator(validator_file, _range_validator(u))
 
     if verbose:
-        print("Downloading: %s Bytes: %s" % (file_name, file_size))
-    file_size_dl = 0
+        print("Downloading: %s Bytes: %s" % (file_name,
+                                             'unknown' if file_size is None else file_size))
+    own_progress = progress is None and verbose
+    if own_progress:
+        progress = DownloadProgress()
+    if progress and file_size is not None:
+        progress.add_total(file_size - offset)
+    file_size_dl = offset
     block_sz = 8192*64*8
-    f = open(file_name, 'wb')
-    while True:
-        buffer = u.read(block_sz)
-        if not buffer:
-            break
-        file_size_dl += len(buffer)
-        f.write(buffer)
-        status = r"%10d  [%3.2f%%]" % (file_size_dl, file_size_dl * 100. / file_size)
-        if verbose:
-            print(status)
-    f.close()
+    # the hash is computed while writing, only the bytes of a resumed part are read again
+    hasher = hashlib.new(hash_name)
+    if (range_workers > 1 and offset == 0 and file_size is not None and
+            file_size >= range_min_bytes and u.getheader('Accept-Ranges') == 'bytes' and
+            decoder is None and decompressor is None):
+        file_size_dl = _download_ranges(opener, full_link_to_file, u, part_file, file_size,
+                                        range_workers, block_sz, progress=progress)
+        # ranges arrive out of order: hash the file once complete if the hash is needed
+        hasher = _file_hash(part_file, hash_name) if (checksum or cache) else None
+    else:
+        if offset:
+            _file_hash(part_file, hash_name, hasher=hasher)
+        with open(part_file, 'ab' if offset else 'wb') as f:
+            while True:
+                buffer = u.read(block_sz)
+                if not buffer:
+                    break
+                file_size_dl += len(buffer)
+                if progress:
+                    progress.update(len(buffer))
+                if decoder is not None:
+                    buffer = decoder.decompress(buffer)
+                hasher.update(buffer)
+                if decompressor is not None:
+                    buffer = decompressor.decompress(buffer)
+                f.write(buffer)
+    if own_progress:
+        progress.close()
 
+    # the file gets its final name only once complete, otherwise the next call resumes
+    if file_size is not None and file_size_dl != file_size:
+        raise IOError('Incomplete download of ' + full_link_to_file + ': ' +
+                      str(file_size_dl) + ' out of ' + str(file_size) + ' bytes')
+    if any(d is not None and not d.eof for d in (decoder, decompressor)):
+        os.remove(part_file)
+        raise IOError('Truncated compressed stream for ' + full_link_to_file)
+    digest = hasher.hexdigest() if hasher else None
+    if checksum and digest != checksum:
+        os.remove(part_file)
+        raise IOError('Checksum mismatch for ' + full_link_to_file + ': ' + hash_name + ' ' +
+                      digest + ' instead of ' + checksum)
+    os.replace(part_file, file_name)
+    if os.path.exists(validator_file):
+        os.remove(validator_file)
+
+    if cache:
+        cache.record(file_name, url=full_link_to_file, hit=False,
+                     hashes={hash_name: digest} if digest else None,
+                     validators={'If-None-Match': u.getheader('ETag'),
+                                 'If-Modified-Since': u.getheader('Last-Modified')})
+        cache.evict(keep=[file_name])
     return file_name
 
 
+def _file_hash(file_name, hash_name='md5', hasher=None):
+    """
+    Hashes a file by blocks.
+
+    :return: the hashlib object, updated with the file content if provided
+    """
+    hasher = hasher or hashlib.new(hash_name)
+    with open(file_name, 'rb') as f:
+        for buffer in iter(functools.partial(f.read, 8192*64*8), b''):
+            hasher.update(buffer)
+    return hasher
+
+
+def _cached_file_hash(cache, file_name, hash_name='md5'):
+    """
+    Hex digest of a cached file, read from the cache index if available. Otherwise the file
+    is hashed once and the digest is stored in the index.
+    """
+    digest = cache.get_hash(file_name, hash_name) if cache else None
+    if digest is None:
+        digest = _file_hash(file_name, hash_name).hexdigest()
+        if cache:
+            cache.set_hash(file_name, hash_name, digest)
+    return digest
+
+
+def _range_validator(u):
+    # If-Range requires a strong ETag, otherwise the Last-Modified date is used
+    etag = u.getheader('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return u.getheader('Last-Modified')
+
+
+def _read_range_validator(file_name):
+    try:
+        with open(file_name) as f:
+            return json.load(f).get('If-Range')
+    except (OSError, ValueError):
+        return None
+
+
+def _write_range_validator(file_name, validator):
+    if not validator:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        return
+    with open(file_name, 'w') as f:
+        json.dump({'If-Range': validator}, f)
+
+
+def _download_ranges(opener, url, u, part_file, file_size, nworkers, block_sz, progress=None):
+    """
+    Downloads a file in nworkers byte ranges fetched over concurrent connections, each written
+    at its offset in a preallocated part file. The response already opened for the full file
+    is used for the first range; the other ranges are requested with its validator so that
+    they all come from the same version of the file.
+
+    :return: number of bytes downloaded
+    """
+    chunk = -(-file_size // nworkers)
+    ranges = [(start, min(start + chunk, file_size)) for start in range(0, file_size, chunk)]
+    if_range = _range_validator(u)
+    with open(part_file, 'wb') as f:
+        f.truncate(file_size)
+
+    def _download_range(rng):
+        start, end = rng
+        if start == 0:
+            resp = u
+        else:
+            request = urllib.request.Request(url)
+            request.add_header('Range', 'bytes={}-{}'.format(start, end - 1))
+            if if_range:
+                request.add_header('If-Range', if_range)
+            resp = opener.open(request)
+            if resp.getcode() != 206:
+                raise IOError('Range request not supported for ' + url)
+        nbytes = 0
+        with open(part_file, 'r+b') as f:
+            f.seek(start)
+            while start + nbytes < end:
+                buffer = resp.read(min(block_sz, end - start - nbytes))
+                if not buffer:
+                    break
+                f.write(buffer)
+                nbytes += len(buffer)
+                if progress:
+                    progress.update(len(buffer))
+        resp.close()
+        return nbytes
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            return sum(executor.map(_download_range, ranges))
+    except Exception:
+        # the part file has holes and can not be resumed
+        os.remove(part_file)
+        raise
+
+
+class DownloadProgress:
+    """
+    Thread safe progress of one or several downloads. Reports the bytes done and total,
+    the instantaneous and average throughput and the estimated time left to a callback,
+    at most once every interval seconds.
+    """
+
+    def __init__(self, callback=None, interval=1.):
+        """
+        :param callback: [None] function called with a dictionary with keys 'bytes_done',
+         'bytes_total', 'rate' and 'average_rate' in bytes/s and 'eta' in seconds.
+         Defaults to print_progress.
+        :type callback: function
+        :param interval: [1.] minimum time between 2 reports, in seconds
+        :type interval: float
+        """
+        self.callback = callback or print_progress
+        self.interval = interval
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self._lock = threading.Lock()
+        self._start = self._last_time = time.time()
+        self._last_bytes = 0
+
+    def add_total(self, nbytes):
+        """
+        Adds the size of a download to the total, when its length becomes known
+        """
+        with self._lock:
+            self.bytes_total += nbytes
+
+    def update(self, nbytes):
+        """
+        Counts nbytes more downloaded bytes and reports if the last report is old enough
+        """
+        with self._lock:
+            self.bytes_done += nbytes
+            if time.time() - self._last_time < self.interval:
+                return
+            info = self._info()
+        self.callback(info)
+
+    def close(self):
+        """
+        Reports the final progress
+        """
+        with self._lock:
+            info = self._info()
+        self.callback(info)
+
+    def _info(self):
+        now = time.time()
+        rate = (self.bytes_done - self._last_bytes) / max(now - self._last_time, 1e-9)
+        average_rate = self.bytes_done / max(now - self._start, 1e-9)
+        self._last_time, self._last_bytes = now, self.bytes_done
+        return {'bytes_done': self.bytes_done,
+                'bytes_total': self.bytes_total,
+                'rate': rate,
+                'average_rate': average_rate,
+                'eta': (self.bytes_total - self.bytes_done) / average_rate if average_rate else 0.}
+
+
+def print_progress(info):
+    """
+    Default DownloadProgress callback: prints a status line
+    """
+    percent = info['bytes_done'] * 100. / info['bytes_total'] if info['bytes_total'] else 100.
+    print(r"%10d / %d  [%3.2f%%]  %.2f MB/s (average %.2f MB/s)  ETA %ds" % (
+        info['bytes_done'], info['bytes_total'], percent, info['rate'] / 1e6,
+        info['average_rate'] / 1e6, info['eta']))
+
+
+def _urlopen_range(opener, url, offset=0, headers=None):
+    """
+    Opens an url with a Range request starting at byte offset.
+
+    :return: the response and the offset at which the response body starts: 0 if the server
+     ignores the Range request or if the range is not satisfiable
+    """
+    request = urllib.request.Request(url, headers=headers or {})
+    if offset:
+        request.add_header('Range', 'bytes={}-'.format(offset))
+    try:
+        u = opener.open(request)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # the local part is not a prefix of the remote file: start again
+        return _urlopen_range(opener, url, 0, headers=headers)
+    if offset and u.getcode() != 206:
+        offset = 0
+    return u, offset
+
+
+class DownloadCache:
+    """
+    Size bounded cache directory for http_download_file.
+
+    An sqlite database in the cache directory records the size, last access time, source url,
+    hashes and validators of each downloaded file, one row per file. Each access updates its
+    own row in a transaction, so that threads and processes sharing the cache directory do
+    not lose updates. When the total size of the indexed files exceeds max_bytes, the least
+    recently used files that are not pinned are deleted. Files in the directory are indexed
+    once downloaded or hashed, others are left alone.
+
+    Recording accesses and hashes is best effort: if the index can not be written, for
+    example in a read-only shared cache, cached files are still served. sqlite locking is
+    unreliable on network filesystems: the cache directory of the index must not be shared by
+    several hosts over NFS or SMB.
+    """
+    INDEX_FILE = '.cache_index.sqlite'
+    # seconds waited for a transaction of another thread or process before raising
+    TIMEOUT = 60.
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, size INTEGER NOT NULL DEFAULT 0,
+            last_access REAL NOT NULL DEFAULT 0, url TEXT NOT NULL DEFAULT '',
+            pinned INTEGER NOT NULL DEFAULT 0, hashes TEXT NOT NULL DEFAULT '{}',
+            validators TEXT NOT NULL DEFAULT '{}');
+        CREATE INDEX IF NOT EXISTS files_last_access ON files (last_access);
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0);
+        """
+
+    def __init__(self, cache_dir='', max_bytes=0):
+        """
+        :param cache_dir: [''] directory in which files are cached; defaults to user's
+         Download directory.
+        :type cache_dir: str
+        :param max_bytes: [0] cache size quota in bytes, 0 for no quota
+        :type max_bytes: int
+        """
+        self.cache_dir = get_cache_dir(cache_dir)
+        self.max_bytes = max_bytes
+        self._index_file = os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    @contextlib.contextmanager
+    def _connect(self, write=False):
+        """
+        Opens the index. If write, yields within a transaction holding the write lock of the
+        database, committed on exit.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        con = sqlite3.connect(self._index_file, timeout=self.TIMEOUT, isolation_level=None)
+        try:
+            con.executescript(self._SCHEMA)
+            if not write:
+                yield con
+                return
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                yield con
+            except BaseException:
+                con.execute('ROLLBACK')
+                raise
+            con.execute('COMMIT')
+        finally:
+            con.close()
+
+    def _key(self, file_name):
+        return os.path.relpath(file_name, self.cache_dir)
+
+    def _entry(self, con, file_name, **defaults):
+        # adds the row of a file if needed and returns its key, url, hashes and validators
+        key = self._key(file_name)
+        columns = ['path'] + list(defaults.keys())
+        con.execute('INSERT OR IGNORE INTO files (' + ', '.join(columns) + ') VALUES (' +
+                    ', '.join('?' * len(columns)) + ')', [key] + list(defaults.values()))
+        url, hashes, validators = con.execute(
+            'SELECT url, hashes, validators FROM files WHERE path = ?', (key,)).fetchone()
+        return key, url, json.loads(hashes), json.loads(validators)
+
+    @staticmethod
+    def _count(con, name):
+        if not con.execute('UPDATE counters SET value = value + 1 WHERE name = ?',
+                           (name,)).rowcount:
+            con.execute('INSERT INTO counters (name, value) VALUES (?, 1)', (name,))
+
+    def record(self, file_name, url='', hit=False, hashes=None, validators=None):
+        """
+        Records an access to a cached file: updates its size and last access time in the
+        index and counts a cache hit or miss.
+
+        :param file_name: local full path of the file
+        :type file_name: str
+        :param url: [''] http link the file was downloaded from
+        :type url: str
+        :param hit: [False] True if the file was already in the cache
+        :type hit: bool
+        :param hashes: [None] hex digests of the file keyed by hashlib algorithm name. On a
+         miss, previously recorded hashes are discarded.
+        :type hashes: dict
+        :param validators: [None] conditional request headers to revalidate the file, built
+         from the ETag and Last-Modified response headers. None values are ignored.
+        :type validators: dict
+        """
+        size = os.path.getsize(file_name)
+        try:
+            with self._connect(write=True) as con:
+                key, old_url, old_hashes, old_validators = self._entry(con, file_name)
+                new_hashes = dict(old_hashes if hit else {}, **(hashes or {}))
+                if validators is not None:
+                    old_validators = {k: v for k, v in validators.items() if v}
+                con.execute('UPDATE files SET size = ?, last_access = ?, url = ?, '
+                            'hashes = ?, validators = ? WHERE path = ?',
+                            (size, time.time(), url or old_url, json.dumps(new_hashes),
+                             json.dumps(old_validators), key))
+                self._count(con, 'hits' if hit else 'misses')
+        except (sqlite3.Error, OSError):
+            pass  # read-only or unavailable index: the access is not recorded
+
+    def get_hash(self, file_name, hash_name='md5'):
+        """
+        :return: (str) hex digest of the file recorded in the index, None if not recorded
+         or if the size of the file changed since
+        """
+        try:
+            with self._connect() as con:
+                row = con.execute('SELECT size, hashes FROM files WHERE path = ?',
+                                  (self._key(file_name),)).fetchone()
+        except (sqlite3.Error, OSError):
+            return None
+        if not row or row[0] != os.path.getsize(file_name):
+            return None
+        return json.loads(row[1]).get(hash_name)
+
+    def get_validators(self, file_name):
+        """
+        :return: (dict) conditional request headers recorded for the file, empty if none
+        """
+        try:
+            with self._connect() as con:
+                row = con.execute('SELECT validators FROM files WHERE path = ?',
+                                  (self._key(file_name),)).fetchone()
+        except (sqlite3.Error, OSError):
+            return {}
+        return json.loads(row[0]) if row else {}
+
+    def set_hash(self, file_name, hash_name, digest):
+        """
+        Records the hex digest of a cached file in the index.
+        """
+        size = os.path.getsize(file_name)
+        try:
+            with self._connect(write=True) as con:
+                key, _, hashes, _ = self._entry(con, file_name, last_access=time.time())
+                hashes[hash_name] = digest
+                con.execute('UPDATE files SET size = ?, hashes = ? WHERE path = ?',
+                            (size, json.dumps(hashes), key))
+        except (sqlite3.Error, OSError):
+            pass  # read-only or unavailable index: the file is hashed again next time
+
+    def pin(self, file_name, pinned=True):
+        """
+        Pinned files are never evicted. A file can be pinned before being downloaded.
+
+        :param file_name: local full path of the file
+        :type file_name: str
+        :param pinned: [True] False to unpin the file
+        :type pinned: bool
+        """
+        with self._connect(write=True) as con:
+            key = self._entry(con, file_name)[0]
+            con.execute('UPDATE files SET pinned = ? WHERE path = ?', (int(pinned), key))
+
+    def evict(self, keep=()):
+        """
+        Deletes the least recently used files that are not pinned until the size of the cache
+        is under max_bytes. Files derived from a cached file and named after it (for example
+        file_name + '.npz') are deleted along with it.
+
+        :param keep: list of local full paths of files that are not evicted
+        :type keep: list
+
+        :return: (list) local full paths of the deleted files
+        """
+        if not self.max_bytes:
+            return []
+        keep = set(self._key(fn) for fn in keep)
+        removed = []
+        with self._connect(write=True) as con:
+            total = con.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+            if total <= self.max_bytes:
+                return []
+            lru = con.execute('SELECT path, size FROM files WHERE pinned = 0 '
+                              'ORDER BY last_access').fetchall()
+            for key, size in lru:
+                if total <= self.max_bytes:
+                    break
+                if key in keep:
+                    continue
+                file_name = os.path.join(self.cache_dir, key)
+                for fn in [file_name] + glob.glob(glob.escape(file_name) + '.*'):
+                    if os.path.exists(fn):
+                        os.remove(fn)
+                con.execute('DELETE FROM files WHERE path = ?', (key,))
+                total -= size
+                removed.append(file_name)
+        return removed
+
+    def stats(self):
+        """
+        :return: (dict) number of files, total size in bytes, quota, number of cache hits and
+         misses and hit rate
+        """
+        with self._connect() as con:
+            n_files, size = con.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files').fetchone()
+            counters = dict(con.execute('SELECT name, value FROM counters').fetchall())
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {'n_files': n_files,
+                'size': size,
+                'max_bytes': self.max_bytes,
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.}
+
+
 def file_record_to_url(file_records, urls=[]):
     """
     Translate a Json dictionary to an usable http url for downlading files.
@@ -127,6 +988,184 @@ def dataset_record_to_url(dataset_record):
     return urls
 
 
+def iter_json_list(chunks):
+    """
+    Decodes a json list incrementally from an iterable of text chunks and yields its elements
+    one by one, so that only the element being decoded is held in memory.
+    If the json document is not a list, it is decoded entirely and yielded as a single element.
+
+    :param chunks: iterable of str, for example the decoded chunks of a http response
+    :return: generator of json interpreted objects
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    eof = False
+
+    def _read():
+        nonlocal buf, pos, eof
+        try:
+            buf = buf[pos:] + next(chunks)
+        except StopIteration:
+            buf = buf[pos:]
+            eof = True
+        pos = 0
+
+    def _skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            _read()
+
+    _skip(' \t\r\n')
+    if pos == len(buf):
+        return
+    if buf[pos] != '[':
+        while not eof:
+            _read()
+        yield json.loads(buf[pos:])
+        return
+    pos += 1
+    while True:
+        _skip(' \t\r\n,')
+        if pos == len(buf):
+            raise ValueError('Truncated json list')
+        if buf[pos] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+            # a number cut by the end of the buffer may continue in the next chunk: a value is
+            # complete once followed by a delimiter
+            complete = eof or (end < len(buf) and buf[end] in ' \t\r\n,]')
+        except ValueError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            _read()
+            continue
+        pos = end
+        yield obj
+
+
+# time to live in seconds of the cached GET responses of the Alyx endpoints
+RESPONSE_CACHE_TTL = {
+    '/dataset-types': 3600,
+    '/users': 3600,
+    '/subjects': 600,
+    '/sessions': 60,
+}
+
+
+class ResponseCache:
+    """
+    Two tier cache of Alyx GET responses: an in memory LRU and an optional directory of json
+    files shared between processes. Entries are keyed by server, user and normalized query
+    and expire after the time to live of their endpoint. All entries of an endpoint are
+    invalidated at once, for example after a POST request.
+    """
+
+    def __init__(self, max_entries=256, ttl=None, cache_dir=None):
+        """
+        :param max_entries: [256] number of responses kept in memory
+        :type max_entries: int
+        :param ttl: [None] time to live in seconds by endpoint, defaults to RESPONSE_CACHE_TTL
+        :type ttl: dict
+        :param cache_dir: [None] directory of the on disk tier, no disk tier if None
+        :type cache_dir: str
+        """
+        self.max_entries = max_entries
+        self.ttl = RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.cache_dir = cache_dir
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(rest_query, username='', base_url=''):
+        """
+        Normalizes a relative query: sorted parameters, no trailing slash, prefixed by the
+        server url and the user, so that responses of different servers are not mixed
+
+        :return: (str) cache key
+        """
+        parsed = urllib.parse.urlsplit(rest_query)
+        query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parsed.query)))
+        return (base_url.rstrip('/') + ' ' + username + ' ' + parsed.path.rstrip('/') +
+                ('?' + query if query else ''))
+
+    @staticmethod
+    def _endpoint(key):
+        # first path element of the query, example: '/sessions'. The query is url encoded
+        # and holds no space
+        return '/' + key.rsplit(' ', 1)[-1].split('?')[0].strip('/').split('/')[0]
+
+    def _file(self, key):
+        return os.path.join(self.cache_dir, self._endpoint(key).strip('/'),
+                            hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        """
+        :return: a copy of the cached response, None if not cached or expired
+        """
+        ttl = self.ttl.get(self._endpoint(key), 0)
+        if not ttl:
+            return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None and self.cache_dir:
+            try:
+                with open(self._file(key)) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+        if entry is None or time.time() - entry['time'] > ttl:
+            return None
+        return copy.deepcopy(entry['data'])
+
+    def set(self, key, data):
+        """
+        Caches a response if its endpoint has a time to live
+        """
+        if not self.ttl.get(self._endpoint(key), 0):
+            return
+        entry = {'time': time.time(), 'data': copy.deepcopy(data)}
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+        if self.cache_dir:
+            file_name = self._file(key)
+            tmp_file = '{}.{}.{}.tmp'.format(file_name, os.getpid(), threading.get_ident())
+            # the disk tier is best effort: an unusable directory, or an invalidation removing
+            # it meanwhile, leaves the response cached in memory only
+            try:
+                os.makedirs(os.path.dirname(file_name), exist_ok=True)
+                with open(tmp_file, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(tmp_file, file_name)
+            except OSError:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+
+    def invalidate(self, rest_query):
+        """
+        Removes the cached responses of the endpoint of a query, for all users
+        """
+        endpoint = self._endpoint(self.key(rest_query))
+        with self._lock:
+            for key in [k for k in self._memory if self._endpoint(k) == endpoint]:
+                del self._memory[key]
+        if self.cache_dir and endpoint.strip('/'):
+            shutil.rmtree(os.path.join(self.cache_dir, endpoint.strip('/')), ignore_errors=True)
+
+
 class AlyxClient:
     """
     Class that implements simple GET/POST wrappers for the Alyx REST API
@@ -135,7 +1174,8 @@ class AlyxClient:
     _token = ''
     _headers = ''
 
-    def __init__(self, **kwargs):
+    def __init__(self, pool_maxsize=10, max_retries=3, backoff_factor=0.5, cache_size=256,
+                 cache_ttl=None, cache_dir=None, token_file=None, **kwargs):
         """
         Create a client instance that allows to GET and POST to the Alyx server
         For oneibl, constructor attempts to authenticate with credentials in params.py
@@ -147,13 +1187,48 @@ class AlyxClient:
         :type password: str
         :param base_url: Alyx server address, including port and protocol
         :type base_url: str
+        :param pool_maxsize: [10] number of connections kept alive for reuse
+        :type pool_maxsize: int
+        :param max_retries: [3] number of retries of idempotent requests (GET) on connection
+         errors and 5xx responses. POST requests are never retried.
+        :type max_retries: int
+        :param backoff_factor: [0.5] retries wait backoff_factor * 2 ** (retry - 1) seconds
+        :type backoff_factor: float
+        :param cache_size: [256] number of GET responses kept in the in memory cache
+        :type cache_size: int
+        :param cache_ttl: [None] time to live in seconds of cached GET responses by endpoint,
+         example: {'/users': 3600}. Endpoints not listed are not cached. Defaults to
+         RESPONSE_CACHE_TTL.
+        :type cache_ttl: dict
+        :param cache_dir: [None] if specified, GET responses are also cached on disk in this
+         directory and shared between processes
+        :type cache_dir: str
+        :param token_file: [None] if specified, the authentication token is saved in this file,
+         readable by the user only, and reused by the next clients instead of authenticating
+         again. A new token is requested only when the server rejects the saved one.
+        :type token_file: str
         """
+        self._token_file = token_file
+        self._cache = ResponseCache(max_entries=cache_size, ttl=cache_ttl, cache_dir=cache_dir)
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+        # the http session keeps connections alive between requests
+        self._session = requests.Session()
+        # by default urllib3 only retries idempotent methods: POST is not retried
+        retries = Retry(total=self._max_retries, backoff_factor=self._backoff_factor,
+                        status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize,
+                                                max_retries=retries)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
         self.authenticate(**kwargs)
 
     def authenticate(self, username='', password='', base_url=''):
         """
         Gets a security token from the Alyx REST API to create requests headers.
         Credentials are in the params_secret_template.py file
+        If a token for this user and server is saved in the token file, it is used without
+        sending a request.
 
         :param username: Alyx database user
         :type username: str
@@ -163,20 +1238,72 @@ class AlyxClient:
         :type base_url: str
         """
         self._base_url = base_url
-        rep = requests.post(base_url + '/auth-token',
-                            data=dict(username=username, password=password))
-        self._token = rep.json()
-        if not (list(self._token.keys()) == ['token']):
+        self._username = username
+        self._password = password
+        token = self._load_token()
+        if token is None:
+            token = self._request_token()
+        self._set_token(token)
+
+    def _request_token(self):
+        rep = self._session.post(self._base_url + '/auth-token',
+                                 data=dict(username=self._username, password=self._password))
+        token = rep.json()
+        if not (list(token.keys()) == ['token']):
             print(rep)
             raise Exception('Alyx authentication error. Check your ./oneibl/params.py and'
                             './oneibl/params_secret.py')
+        self._save_token(token['token'])
+        return token['token']
+
+    def _set_token(self, token):
+        self._token = {'token': token}
         self._headers = {
-                'Authorization': 'Token {}'.format(list(self._token.values())[0]),
-                'Accept': 'application/json',
-                'Content-Type': 'application/json',
-            }
+            'Authorization': 'Token {}'.format(token),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
 
-    def get(self, rest_query):
+    def _token_key(self):
+        return self._base_url + ' ' + self._username
+
+    def _load_token(self):
+        if not self._token_file or not os.path.isfile(self._token_file):
+            return None
+        try:
+            with open(self._token_file) as f:
+                return json.load(f).get(self._token_key())
+        except (OSError, ValueError):
+            return None
+
+    def _save_token(self, token):
+        if not self._token_file:
+            return
+        tokens = {}
+        if os.path.isfile(self._token_file):
+            try:
+                with open(self._token_file) as f:
+                    tokens = json.load(f)
+            except (OSError, ValueError):
+                pass
+        tokens[self._token_key()] = token
+        # the token gives access to the database: the file is readable by the user only
+        tmp_file = self._token_file + '.{}.tmp'.format(os.getpid())
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tokens, f)
+        os.replace(tmp_file, self._token_file)
+
+    def _send(self, method, rest_query, data=None):
+        r = method(self._base_url + rest_query, stream=True, headers=self._headers, data=data)
+        if r.status_code == 401:
+            # the saved token was rejected by the server: authenticate again and resend
+            self._set_token(self._request_token())
+            r = method(self._base_url + rest_query, stream=True, headers=self._headers,
+                       data=data)
+        return r
+
+    def get(self, rest_query, use_cache=True):
         """
         Sends a GET request to the Alyx server. Will raise an exception on any status_code
         other than 200, 201.
@@ -185,18 +1312,74 @@ class AlyxClient:
 
         :param rest_query: example: '/sessions?user=Hamish'.
         :type rest_query: str
+        :param use_cache: [True] if False, bypasses the response cache
+        :type use_cache: bool
 
         :return: (dict/list) json interpreted dictionary from response
         """
         rest_query = rest_query.replace(self._base_url, '')
-        r = requests.get(self._base_url + rest_query, stream=True, headers=self._headers,
-                         data=None)
+        key = self._cache.key(rest_query, self._username, self._base_url)
+        if use_cache:
+            rep = self._cache.get(key)
+            if rep is not None:
+                return rep
+        r = self._send(self._session.get, rest_query)
         if r and r.status_code in (200, 201):
-            return json.loads(r.text)
+            rep = json.loads(r.text)
+            self._cache.set(key, rep)
+            return rep
         else:
             print(self._base_url + rest_query)
             raise Exception(r)
 
+    def get_stream(self, rest_query, chunk_size=64 * 1024):
+        """
+        Sends a GET request to the Alyx server and yields the records of the list response as
+        they are decoded from the connection, see iter_json_list. The response is not cached.
+        Will raise an exception on any status_code other than 200, 201.
+
+        :param rest_query: example: '/sessions?user=Hamish'.
+        :type rest_query: str
+        :param chunk_size: [65536] number of bytes read from the connection at a time
+        :type chunk_size: int
+
+        :return: generator of json interpreted records
+        """
+        rest_query = rest_query.replace(self._base_url, '')
+        r = self._send(self._session.get, rest_query)
+        if not (r and r.status_code in (200, 201)):
+            print(self._base_url + rest_query)
+            raise Exception(r)
+        decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')()
+        chunks = (decoder.decode(c) for c in r.iter_content(chunk_size=chunk_size))
+        try:
+            yield from iter_json_list(chunks)
+        finally:
+            r.close()
+
+    def get_pages(self, rest_query, page_size=100):
+        """
+        Sends paginated GET requests to the Alyx server and yields results page by page,
+        following the 'next' links of the paginated responses. If the server does not
+        paginate this endpoint, the full list is yielded as a single page.
+
+        :param rest_query: example: '/sessions?user=Hamish'.
+        :type rest_query: str
+        :param page_size: [100] number of records per page
+        :type page_size: int
+
+        :return: (generator) yields lists of json interpreted dictionaries
+        """
+        sep = '&' if '?' in rest_query else '?'
+        rest_query = rest_query + sep + 'limit={}&offset=0'.format(page_size)
+        while rest_query:
+            rep = self.get(rest_query)
+            if not isinstance(rep, dict) or 'results' not in rep:
+                yield rep
+                return
+            yield rep['results']
+            rest_query = rep['next']
+
     def post(self, rest_query, data=None):
         """
         Sends a POST request to the Alyx server.
@@ -206,13 +1389,157 @@ class AlyxClient:
         :param rest_query: (required)the endpoint as full or relative URL
         :type rest_query: str
         :param data: json encoded string
-        :type data: None, dict or str
+        :type data: None, dict, list or str
 
         :return: response object
         """
-        if isinstance(data, dict):
+        if isinstance(data, (dict, list)):
             data = json.dumps(data)
         rest_query = rest_query.replace(self._base_url, '')
-        r = requests.post(self._base_url + rest_query, stream=True, headers=self._headers,
-                          data=data)
+        r = self._send(self._session.post, rest_query, data=data)
+        # cached responses of the modified resource are out of date
+        self._cache.invalidate(rest_query)
         return r
+
+    def post_many(self, rest_query, data_list, max_workers=8, batch_size=1):
+        """
+        Sends POST requests for a list of payloads on max_workers concurrent connections.
+        A failed request does not abort the others.
+
+        :param rest_query: (required)the endpoint as full or relative URL
+        :type rest_query: str
+        :param data_list: list of payloads
+        :type data_list: list of dict
+        :param max_workers: [8] number of concurrent requests
+        :type max_workers: int
+        :param batch_size: [1] if > 1, payloads are posted by lists of batch_size items, for
+         endpoints that accept a list of records. The items of a batch rejected by the server
+         (4xx status) are posted again one by one to isolate the failures. Other failures, and
+         responses that do not hold one record per item, are reported for every item of the
+         batch as its records may have been created.
+        :type batch_size: int
+
+        :return: list of json interpreted responses matching data_list (None for failures),
+         list of errors matching data_list (None for successes)
+        :rtype: list, list
+        """
+        def _post(data):
+            # returns the response, the error and the status code, None if no response
+            try:
+                r = self.post(rest_query, data=data)
+            except Exception as e:
+                return None, e, None
+            if r.status_code not in (200, 201):
+                return None, Exception(r), r.status_code
+            return r.json(), None, r.status_code
+
+        def _post_batch(batch):
+            if len(batch) == 1:
+                return [_post(batch[0])[:2]]
+            rep, err, status = _post(batch)
+            if err is None:
+                if isinstance(rep, list) and len(rep) == len(batch):
+                    return [(r, None) for r in rep]
+                err = Exception('Unexpected response to a batch of ' + str(len(batch)) +
+                                ' records: ' + str(rep)[:200])
+            elif status is not None and 400 <= status < 500:
+                return [_post(data)[:2] for data in batch]
+            return [(None, err)] * len(batch)
+
+        batches = [data_list[i:i + batch_size] for i in range(0, len(data_list), batch_size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = [r for res in executor.map(_post_batch, batches) for r in res]
+        return [r[0] for r in results], [r[1] for r in results]
+
+
+def register_datasets(alyx_client, datasets, max_workers=8, batch_size=1):
+    """
+    Registers datasets and their file records in Alyx with concurrent, optionally batched,
+    POST requests, see AlyxClient.post_many. A failure does not abort the registration of
+    the other datasets.
+
+    :param alyx_client: authenticated client
+    :type alyx_client: AlyxClient
+    :param datasets: list of /datasets payloads. Each may have a 'file_records' key with a list
+     of /files payloads, whose 'dataset' field is set to the url of the created dataset.
+    :type datasets: list of dict
+    :param max_workers: [8] number of concurrent requests
+    :type max_workers: int
+    :param batch_size: [1] number of records per request for endpoints accepting lists
+    :type batch_size: int
+
+    :return: list of the created dataset records (None for failures), list of errors: None if
+     the dataset and all its file records were registered
+    :rtype: list, list
+    """
+    payloads = [{k: v for k, v in d.items() if k != 'file_records'} for d in datasets]
+    created, errors = alyx_client.post_many('/datasets', payloads, max_workers=max_workers,
+                                            batch_size=batch_size)
+    # the file records of a dataset are posted once the dataset exists
+    file_records, owners = [], []
+    for i, d in enumerate(datasets):
+        if errors[i] is not None:
+            continue
+        for fr in d.get('file_records', []):
+            file_records.append(dict(fr, dataset=created[i]['url']))
+            owners.append(i)
+    _, file_errors = alyx_client.post_many('/files', file_records, max_workers=max_workers,
+                                           batch_size=batch_size)
+    for i, err in zip(owners, file_errors):
+        if err is not None and errors[i] is None:
+            errors[i] = err
+    return created, errors
+
+
+class AsyncAlyxClient:
+    """
+    Asyncio counterpart of AlyxClient: get, get_pages and post are awaitable.
+    Requests run in a thread pool of max_concurrency workers and share the connection pool of
+    the http session of the wrapped AlyxClient. Connections beyond the pool_maxsize of that
+    pool are closed after each request rather than kept alive.
+    """
+
+    def __init__(self, alyx_client=None, max_concurrency=16, executor=None, **kwargs):
+        """
+        :param alyx_client: [None] AlyxClient to wrap, preferably created with a pool_maxsize
+         of at least max_concurrency. If None an AlyxClient with a pool of max_concurrency
+         connections is created from kwargs: AsyncAlyxClient(username='', password='',
+         base_url='')
+        :type alyx_client: AlyxClient
+        :param max_concurrency: [16] maximum number of concurrent requests
+        :type max_concurrency: int
+        :param executor: [None] concurrent.futures executor to share with other clients,
+         if None a thread pool of max_concurrency workers is created
+        """
+        self._client = alyx_client or AlyxClient(pool_maxsize=max_concurrency, **kwargs)
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def get(self, rest_query):
+        """
+        Awaitable AlyxClient.get
+        """
+        return await self._run(self._client.get, rest_query)
+
+    async def get_pages(self, rest_query, page_size=100):
+        """
+        Awaitable AlyxClient.get_pages: async generator yielding lists of records page by page
+        """
+        pages = self._client.get_pages(rest_query, page_size=page_size)
+        while True:
+            page = await self._run(next, pages, None)
+            if page is None:
+                return
+            yield page
+
+    async def post(self, rest_query, data=None):
+        """
+        Awaitable AlyxClient.post
+        """
+        return await self._run(self._client.post, rest_query, data)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
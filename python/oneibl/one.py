@@ -1,8 +1,16 @@
 import numpy as np
+import pandas as pd
 import os
+import json
+import threading
+import asyncio
+import functools
+import operator
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 from dataclasses import dataclass, field
 import ibllib.webclient as wc
 from ibllib.misc import is_uuid_string, pprint
+from ibllib.time import format_date_range
 import oneibl.params as par
 import abc
 
@@ -25,7 +33,9 @@ class OneAbstract(abc.ABC):
 @dataclass
 class SessionInfo:
     """
-    Dataclass that provides dataset list, dataset_id, local_path, dataset_type, url and eid fields
+    Dataclass that provides dataset list, dataset_id, local_path, dataset_type, url, eid and
+    md5 fields
+    dataset_type_index maps each dataset type to the indices of its datasets in the lists
     """
     data:  list = field(default_factory=list)
     dataset_id: list = field(default_factory=list)
@@ -33,6 +43,8 @@ class SessionInfo:
     dataset_type: list = field(default_factory=list)
     url: list = field(default_factory=list)
     eid: list = field(default_factory=list)
+    md5: list = field(default_factory=list)
+    dataset_type_index: dict = field(default_factory=dict)
 
     def __str__(self):
         """
@@ -41,16 +53,352 @@ class SessionInfo:
         str_out = ''
         d = self.__dict__
         for k in d.keys():
+            if not isinstance(d[k], list):
+                continue
             str_out += (k + '    : ' + str(type(d[k])) + ' , ' + str(len(d[k])) + ' items = '
                         + str(d[k][0])) + '\n'
         return str_out
 
 
+class DatasetProxy:
+    """
+    Placeholder for a dataset in SessionInfo.data, downloaded and loaded on first access.
+    .npy files are memory-mapped so that only the indexed parts are read from disk.
+    Indexing, iteration, len(), np.asarray(), arithmetic, bitwise and comparison operators
+    and array attributes are forwarded to the loaded data. Type checks and in-place operators
+    are not: use the data property to get the loaded object itself.
+    """
+
+    def __init__(self, one, session_info, index):
+        self._one = one
+        self._session_info = session_info
+        self._index = index
+        self._data = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return self._session_info.url[self._index]
+
+    @property
+    def data(self):
+        """
+        Downloads the file if needed and returns the loaded data
+        """
+        with self._lock:
+            if not self._loaded:
+                fil = self._session_info.local_path[self._index]
+                if not fil:
+                    fil = self._one._download_file(
+                        self.url, checksum=self._session_info.md5[self._index])
+                    self._session_info.local_path[self._index] = fil
+                self._data = _load_file(fil, mmap_mode='r')
+                self._loaded = True
+        return self._data
+
+    def __getitem__(self, item):
+        return self.data[item]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __array__(self, *args, **kwargs):
+        return np.asarray(self.data, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __contains__(self, item):
+        return item in self.data
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.data, name)
+
+    def __repr__(self):
+        status = 'loaded' if self._loaded else 'not loaded'
+        return 'DatasetProxy(' + str(self.url) + ', ' + status + ')'
+
+
+def _forward_operator(op, reflected=False):
+    if reflected:
+        return lambda self, other: op(other, self.data)
+    return lambda self, *args: op(self.data, *args)
+
+
+# binary operators are forwarded along with their reflected form, so that 1 + proxy works
+for _name in ('add', 'sub', 'mul', 'matmul', 'truediv', 'floordiv', 'mod', 'pow', 'lshift',
+              'rshift', 'and', 'xor', 'or'):
+    _op = getattr(operator, _name + '_' if _name in ('and', 'or') else _name)
+    setattr(DatasetProxy, '__' + _name + '__', _forward_operator(_op))
+    setattr(DatasetProxy, '__r' + _name + '__', _forward_operator(_op, reflected=True))
+for _name in ('lt', 'le', 'eq', 'ne', 'gt', 'ge', 'neg', 'pos', 'abs', 'invert'):
+    setattr(DatasetProxy, '__' + _name + '__', _forward_operator(getattr(operator, _name)))
+
+
+def _index_by_type(dataset_types):
+    """
+    :param dataset_types: iterable of dataset types
+    :return: dictionary mapping each dataset type to the list of its positions
+    :rtype: dict
+    """
+    index = {}
+    for i, dt in enumerate(dataset_types):
+        index.setdefault(dt, []).append(i)
+    return index
+
+
+def _record_md5(dataset_record):
+    # Alyx stores the md5 of datasets as an UUID: remove the dashes to get the hex digest
+    md5 = dataset_record.get('md5')
+    return md5.replace('-', '').lower() if md5 else None
+
+
+def _load_npy(file_name, mmap_mode=None):
+    return np.load(file=file_name, mmap_mode=mmap_mode)
+
+
+def _load_json(file_name, mmap_mode=None):
+    with open(file_name, 'r') as f:
+        txt = f.read()
+    try:
+        return json.loads(txt)
+    except ValueError:
+        # files written by the rig may hold one json object per line
+        return [json.loads(line) for line in txt.splitlines() if line.strip()]
+
+
+def _load_csv(file_name, mmap_mode=None):
+    return _load_table_cached(file_name, sep=',')
+
+
+def _load_tsv(file_name, mmap_mode=None):
+    return _load_table_cached(file_name, sep='\t')
+
+
+def _load_table_cached(file_name, sep):
+    """
+    Parses a tabular file into a pandas DataFrame with inferred column types. The parsed
+    columns are saved in a numpy .npz archive next to the file so that it is parsed only once
+    per download. The archive holds no pickled objects and is safe to read from a shared cache.
+    """
+    cache_file = file_name + '.npz'
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(file_name):
+        try:
+            return _read_table_npz(cache_file)
+        except (OSError, ValueError, KeyError):
+            pass  # unreadable archive: parse again
+    df = pd.read_csv(file_name, sep=sep)
+    try:
+        _write_table_npz(cache_file, df)
+    except OSError:
+        pass  # read-only cache directory: parse again next time
+    return df
+
+
+def _write_table_npz(file_name, df):
+    # text columns are stored as unicode arrays with a mask of missing values. Tables with
+    # other object columns are not cached as they can not be saved without pickling
+    arrays = {'columns': np.array([str(c) for c in df.columns])}
+    for i, col in enumerate(df.columns):
+        values = df[col].to_numpy()
+        if values.dtype == object:
+            mask = df[col].isna().to_numpy()
+            if not all(isinstance(v, str) for v in values[~mask]):
+                return
+            values = np.where(mask, '', values).astype(str)
+            arrays['mask_' + str(i)] = mask
+        arrays['col_' + str(i)] = values
+    # write in a temporary file first so that concurrent readers never see partial files
+    tmp_file = file_name + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_file, file_name)
+
+
+def _read_table_npz(file_name):
+    with np.load(file_name, allow_pickle=False) as npz:
+        columns = npz['columns']
+        data = {}
+        for i, col in enumerate(columns):
+            values = npz['col_' + str(i)]
+            if 'mask_' + str(i) in npz.files:
+                values = values.astype(object)
+                values[npz['mask_' + str(i)]] = np.nan
+            data[col] = values
+    return pd.DataFrame(data, columns=columns)
+
+
+# loader functions by file extension: loader(file_name, mmap_mode=None) returns the data.
+# mmap_mode is only a hint for loaders that support memory mapping
+LOADERS = {
+    '.npy': _load_npy,
+    '.json': _load_json,
+    '.csv': _load_csv,
+    '.tsv': _load_tsv,
+}
+
+
+def register_loader(extension, loader):
+    """
+    Registers the function used by ONE.load to read files with a given extension.
+
+    :param extension: file extension including the dot, example: '.npy'
+    :type extension: str
+    :param loader: function loader(file_name, mmap_mode=None) returning the loaded data
+    :type loader: function
+    """
+    LOADERS[extension.lower()] = loader
+
+
+def _load_file(fil, mmap_mode=None):
+    """
+    Loads a dataset file in memory using the loader registered for its extension.
+    If there is no loader for this extension, or if the file can not be parsed, returns an
+    empty list so that the other datasets of a session still load.
+
+    :param fil: local full path of the file
+    :type fil: str
+    :param mmap_mode: [None] passed to np.load for .npy files: 'r' memory-maps the array
+    :type mmap_mode: str
+
+    :return: loaded data
+    """
+    if not fil:
+        return []
+    loader = LOADERS.get(os.path.splitext(fil)[1].lower())
+    if loader is None:
+        return []
+    try:
+        return loader(fil, mmap_mode=mmap_mode)
+    except ValueError as e:
+        # json, csv and npy parsing errors all derive from ValueError
+        print('Warning: could not parse ' + fil + ' (' + str(e) + ')')
+        return []
+
+
+class LocalIndex:
+    """
+    On-disk index of the session records and tables fetched from Alyx, used by ONE to answer
+    list, search, ls and load queries in offline mode. Each session record is stored in its
+    own json file in the <cache_dir>/.one_index/sessions directory. Records are written only
+    when they changed since they were last added by this instance.
+    """
+
+    def __init__(self, cache_dir):
+        self._dir = os.path.join(cache_dir, '.one_index')
+        self._ses_dir = os.path.join(self._dir, 'sessions')
+        # json text of the files written by this instance, keyed by file name
+        self._written = {}
+
+    def _write_json(self, file_name, obj):
+        txt = json.dumps(obj, sort_keys=True)
+        if self._written.get(file_name) == txt:
+            return
+        # write in a temporary file first so that concurrent readers never see partial files
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        tmp_file = file_name + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(txt)
+        os.replace(tmp_file, file_name)
+        self._written[file_name] = txt
+
+    @staticmethod
+    def _read_json(file_name):
+        with open(file_name) as f:
+            return json.load(f)
+
+    def add_sessions(self, sessions):
+        """
+        :param sessions: list of session records as returned by the Alyx /sessions endpoint
+        :type sessions: list
+        """
+        for ses in sessions:
+            self._write_json(os.path.join(self._ses_dir, ses['url'][-36:] + '.json'), ses)
+
+    def get_sessions(self, eids):
+        """
+        :param eids: list of session UUIDs
+        :type eids: list
+
+        :return: dictionary of the indexed session records keyed by session UUID
+        :rtype: dict
+        """
+        sessions = {}
+        for eid in eids:
+            file_name = os.path.join(self._ses_dir, eid + '.json')
+            if os.path.exists(file_name):
+                sessions[eid] = self._read_json(file_name)
+        return sessions
+
+    def search(self, dataset_types=None, users=None, subject='', date_range=None):
+        """
+        Same filters as ONE.search, applied to the indexed session records.
+
+        :return: list of matching session records
+        :rtype: list
+        """
+        if not os.path.isdir(self._ses_dir):
+            return []
+        date_range = format_date_range(date_range) if date_range else None
+        out = []
+        for fn in sorted(os.listdir(self._ses_dir)):
+            if not fn.endswith('.json'):
+                continue
+            ses = self._read_json(os.path.join(self._ses_dir, fn))
+            ses_dtypes = set(d['dataset_type'] for d in ses['data_dataset_session_related'])
+            if dataset_types and not set(dataset_types).issubset(ses_dtypes):
+                continue
+            if users and not set(users).issubset(set(ses['users'])):
+                continue
+            if subject and ses['subject'] != subject:
+                continue
+            if date_range and not date_range[0] <= ses['start_time'][:10] <= date_range[1]:
+                continue
+            out.append(ses)
+        return out
+
+    def add_table(self, table, records):
+        self._write_json(os.path.join(self._dir, table + '.json'), records)
+
+    def get_table(self, table):
+        file_name = os.path.join(self._dir, table + '.json')
+        if not os.path.exists(file_name):
+            raise FileNotFoundError('Table ' + table + ' is not in the local index')
+        return self._read_json(file_name)
+
+
 class ONE(OneAbstract):
 
-    def __init__(self, username=par.ALYX_LOGIN, password=par.ALYX_PWD, base_url=par.BASE_URL):
+    def __init__(self, username=par.ALYX_LOGIN, password=par.ALYX_PWD, base_url=par.BASE_URL,
+                 max_workers=par.DOWNLOAD_MAX_WORKERS, offline=False):
+        """
+        :param max_workers: number of concurrent file downloads in ONE.load
+        :type max_workers: int
+        :param offline: [False] if True, does not connect to Alyx: list, search, ls and load
+         are answered from the local index of previously fetched sessions and cached files,
+         see params.LOCAL_INDEX
+        :type offline: bool
+        """
+        self._max_workers = max_workers
+        self._offline = offline
+        # prefetch queue: futures of the downloads in progress keyed by url, and of the
+        # sessions queries of ONE.prefetch
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._prefetch_queries = set()
+        self._prefetch_executor = None
+        self._index = LocalIndex(wc.get_cache_dir(par.CACHE_DIR))
         # Init connection to the database
-        self._alyxClient = wc.AlyxClient(username=username, password=password, base_url=base_url)
+        if offline:
+            self._alyxClient = None
+        else:
+            # the connection pool is sized for the concurrent requests of AsyncONE
+            self._alyxClient = wc.AlyxClient(username=username, password=password,
+                                             base_url=base_url, token_file=par.ALYX_TOKEN_FILE,
+                                             pool_maxsize=par.ASYNC_MAX_CONCURRENCY)
 
     def list(self, eid):
         """
@@ -68,7 +416,8 @@ class ONE(OneAbstract):
         out = list(sorted(set(dses.dataset_type)))
         return out
 
-    def load(self, eid, dataset_types=None, dclass_output=False, dry_run=False):
+    def load(self, eid, dataset_types=None, dclass_output=False, dry_run=False, lazy=False,
+             progress=None):
         """
         From a Session ID and dataset types, queries Alyx database, downloads the data
         from Globus, and loads into numpy array.
@@ -76,79 +425,225 @@ class ONE(OneAbstract):
         :param eid: Experiment ID, for IBL this is the UUID of the Session as per Alyx
          database. Could be a full Alyx URL:
          'http://localhost:8000/sessions/698361f6-b7d0-447d-a25d-42afdef7a0da' or only the UUID:
-         '698361f6-b7d0-447d-a25d-42afdef7a0da'
-        :type eid: str
+         '698361f6-b7d0-447d-a25d-42afdef7a0da'. A list of eids loads several sessions at once.
+        :type eid: str, list
         :param dataset_types: [None]: Alyx dataset types to be returned.
         :type dataset_types: list
         :param dclass_output: [False]: forces the output as dataclass to provide context.
         :type dclass_output: bool
          If None or an empty dataset_type is specified, the output will be a dictionary by default.
+        :param lazy: [False]: returns DatasetProxy objects instead of arrays: each file is
+         downloaded on first access and .npy files are memory-mapped.
+        :type lazy: bool
+        :param progress: [None]: function called with the aggregated progress of the downloads
+         at most once per second, see ibllib.webclient.DownloadProgress. True prints it.
+        :type progress: function, bool
 
         :return: List of numpy arrays matching the size of dataset_types parameter, OR
-         a dataclass containing arrays and context data.
+         a dataclass containing arrays and context data. If eid is a list, a dictionary
+         with one such output per session, keyed by session UUID.
         :rtype: list, dict, dataclass SessionInfo
         """
-        # TODO: feature that downloads a list of datasets from a list of sessions,
-        # TODO in this case force dictionary output
+        outs = self._list_datasets(eid, dataset_types)
+        # downloads the files of all sessions at once in the worker pool
+        if not dry_run and not lazy:
+            self._download_datasets(list(outs.values()), progress=progress)
+        return self._load_output(eid, outs, dataset_types, dclass_output=dclass_output,
+                                 dry_run=dry_run, lazy=lazy)
+
+    def _list_datasets(self, eid, dataset_types):
+        """
+        Queries the sessions and lists the datasets to load, without downloading.
+
+        :return: dictionary of SessionInfo keyed by session UUID
+        :rtype: dict
+        """
+        eids = [self._eid_str(e) for e in ([eid] if isinstance(eid, str) else eid)]
+        # get sessions json information as dictionaries from the alyx API
+        sessions = self._get_sessions(eids)
+        missing = [e for e in eids if e not in sessions]
+        if missing:
+            raise FileNotFoundError('Session ' + ', '.join(missing) + ' does not exist')
+        dataset_types = [dataset_types] if isinstance(dataset_types, str) else dataset_types
+        return {e: self._session_info(sessions[e], e, dataset_types) for e in eids}
+
+    def _load_output(self, eid, outs, dataset_types, dclass_output=False, dry_run=False,
+                     lazy=False):
+        """
+        Loads the downloaded files of the SessionInfo listed by _list_datasets and formats
+        the output of ONE.load.
+        """
+        dataset_types = [dataset_types] if isinstance(dataset_types, str) else dataset_types
+        for e in outs:
+            if lazy and not dry_run:
+                outs[e].data = [DatasetProxy(self, outs[e], i) for i in range(len(outs[e].url))]
+            else:
+                outs[e].data = [_load_file(fil) for fil in outs[e].local_path]
+        # if no dataset_type is provided, force the output to be a dataclass that provides
+        # context to the data
+        if not dclass_output and dataset_types:
+            outs = {e: self._list_output(outs[e], dataset_types) for e in outs}
+        return outs if not isinstance(eid, str) else outs[self._eid_str(eid)]
+
+    @staticmethod
+    def _eid_str(eid):
         # if the input as an UUID, add the beginning of URL to it
         if is_uuid_string(eid):
             eid = '/sessions/' + eid
-        eid_str = eid[-36:]
-        # get session json information as a dictionary from the alyx API
-        ses = self._alyxClient.get('/sessions?id=' + eid_str)
-        if not ses:
-            raise FileNotFoundError('Session ' + eid_str + ' does not exist')
-        ses = ses[0]
-        # if no dataset_type is provided:
-        # a) force the output to be a dictionary that provides context to the data
-        # b) download all types that have a data url specified
-        dataset_types = [dataset_types] if isinstance(dataset_types, str) else dataset_types
+        return eid[-36:]
+
+    def _get_sessions(self, eids):
+        """
+        Queries the sessions records for a list of eids, in batches of SESSIONS_BATCH_SIZE
+        ids per request.
+
+        :param eids: list of session UUIDs
+        :type eids: list
+
+        :return: dictionary of session records keyed by session UUID
+        :rtype: dict
+        """
+        if self._offline:
+            return self._index.get_sessions(eids)
+        if len(eids) == 1:
+            ses = self._alyxClient.get('/sessions?id=' + eids[0])
+            self._index_sessions(ses)
+            return {eids[0]: ses[0]} if ses else {}
+        uids = list(dict.fromkeys(eids))
+        sessions = {}
+        for i in range(0, len(uids), par.SESSIONS_BATCH_SIZE):
+            ses = self._alyxClient.get('/sessions?id=' + ','.join(
+                uids[i:i + par.SESSIONS_BATCH_SIZE]))
+            self._index_sessions(ses)
+            sessions.update({s['url'][-36:]: s for s in ses})
+        return sessions
+
+    def _index_sessions(self, sessions):
+        # session records are saved for offline use only if the local index is enabled
+        if par.LOCAL_INDEX:
+            self._index.add_sessions(sessions)
+
+    @staticmethod
+    def _session_info(ses, eid_str, dataset_types):
+        """
+        Lists the datasets matching dataset_types in a session record, without downloading.
+        If no dataset_type is provided, lists all types that have a data url specified.
+        """
+        dsets = ses['data_dataset_session_related']
         if not dataset_types:
-            dclass_output = True
-            dataset_types = [d['dataset_type'] for d in ses['data_dataset_session_related']
-                             if d['data_url']]
-        # loop over each dataset related to the session ID and get list of files urls
-        session_dtypes = [d['dataset_type'] for d in ses['data_dataset_session_related']]
+            dataset_types = [d['dataset_type'] for d in dsets if d['data_url']]
+        # index the datasets related to the session ID by type once
+        session_index = _index_by_type(d['dataset_type'] for d in dsets)
         out = SessionInfo()
-        # this first loop only downloads the file to ease eventual refactoring
-        for ind, dt in enumerate(dataset_types):
-            for [i, sdt] in enumerate(session_dtypes):
-                if sdt == dt:
-                    urlstr = ses['data_dataset_session_related'][i]['data_url']
-                    if not dry_run:
-                        fil = wc.http_download_file(urlstr,
-                                                    username=par.HTTP_DATA_SERVER_LOGIN,
-                                                    password=par.HTTP_DATA_SERVER_PWD,
-                                                    cache_dir=par.CACHE_DIR)
-                    else:
-                        fil = ''
-                    out.eid.append(eid_str)
-                    out.dataset_type.append(dt)
-                    out.url.append(urlstr)
-                    out.local_path.append(fil)
-                    out.dataset_id.append(ses['data_dataset_session_related'][i]['id'])
-                    out.data.append([])
-        # then another loop over files and load them in numpy. If not npy, just pass empty list
-        for ind, fil in enumerate(out.local_path):  # this is where I miss switch case
-            if fil and os.path.splitext(fil)[1] == '.npy':
-                out.data[ind] = np.load(file=fil)
-            if fil and os.path.splitext(fil)[1] == '.json':
-                pass  # FIXME would be nice to implement json read but param from matlab RIG fails
-            if fil and os.path.splitext(fil)[1] == '.tsv':
-                pass # TODO: implement csv reads as well
-            if fil and os.path.splitext(fil)[1] == '.csv':
-                pass # TODO: implement tsv reads as well
-        if dclass_output:
-            return out
-        # if required, parse the output as a list that matches dataset types provided
+        for dt in dataset_types:
+            for i in session_index.get(dt, []):
+                out.dataset_type_index.setdefault(dt, []).append(len(out.dataset_type))
+                out.eid.append(eid_str)
+                out.dataset_type.append(dt)
+                out.url.append(dsets[i]['data_url'])
+                out.local_path.append('')
+                out.dataset_id.append(dsets[i]['id'])
+                out.md5.append(_record_md5(dsets[i]))
+                out.data.append([])
+        return out
+
+    def _download_datasets(self, outs, progress=None):
+        """
+        Downloads the files of a list of SessionInfo in the worker pool and fills local paths.
+        The order of files is preserved. If progress is a function or True, the aggregated
+        progress of all downloads is reported instead of one status per file.
+        """
+        urls = [url for out in outs for url in out.url]
+        checksums = dict(zip(urls, [md5 for out in outs for md5 in out.md5]))
+        # files being prefetched are waited for rather than downloaded again
+        with self._lock:
+            inflight = {url: self._inflight[url] for url in urls if url in self._inflight}
+        todo = [url for url in urls if url not in inflight]
+        if self._offline:
+            files = [self._cached_file(url) for url in todo]
+            errors = [None if f or not url else 'not in the local cache'
+                      for f, url in zip(files, todo)]
+        else:
+            kwargs = self._download_kwargs()
+            if progress:
+                kwargs['verbose'] = False
+                kwargs['progress'] = wc.DownloadProgress(
+                    callback=None if progress is True else progress)
+            files, errors = wc.http_download_file_list(
+                todo, max_workers=self._max_workers, return_errors=True,
+                checksums=[checksums[url] for url in todo], **kwargs)
+            if progress:
+                kwargs['progress'].close()
+        results = dict(zip(todo, zip(files, errors)))
+        for url, future in inflight.items():
+            try:
+                results[url] = (self._prefetched_file(future, url, checksums[url]), None)
+            except Exception as e:
+                results[url] = ('', e)
+        self._set_local_paths(outs, urls, [results[url][0] for url in urls],
+                              [results[url][1] for url in urls])
+
+    @staticmethod
+    def _set_local_paths(outs, urls, files, errors):
+        # fills the paths of all files before raising the errors of the whole batch, so that
+        # the successful downloads are kept in the cache
+        for out in outs:
+            n = len(out.url)
+            out.local_path, files = files[:n], files[n:]
+        failed = [url + ' (' + str(err) + ')' for url, err in zip(urls, errors) if err]
+        if failed:
+            raise IOError('Download failed: ' + ', '.join(failed))
+
+    def _download_file(self, url, checksum=None):
+        # waits for the file if it is being prefetched
+        with self._lock:
+            future = self._inflight.get(url)
+        if future is not None:
+            return self._prefetched_file(future, url, checksum)
+        return self._fetch_file(url, checksum=checksum)
+
+    def _prefetched_file(self, future, url, checksum=None):
+        # waits for a prefetch, a prefetch cancelled by ONE.close is downloaded here instead
+        try:
+            return future.result()
+        except CancelledError:
+            return self._fetch_file(url, checksum=checksum)
+
+    def _fetch_file(self, url, checksum=None):
+        if self._offline:
+            fil = self._cached_file(url)
+            if url and not fil:
+                raise FileNotFoundError(url + ' is not in the local cache')
+            return fil
+        return wc.http_download_file(url, checksum=checksum, **self._download_kwargs())
+
+    @staticmethod
+    def _cached_file(url):
+        # local file name of an already downloaded file, '' if not in the cache
+        if not url:
+            return ''
+        fil = wc.cached_file_name(url, cache_dir=par.CACHE_DIR,
+                                  decompress=par.DOWNLOAD_DECOMPRESS)
+        return fil if os.path.exists(fil) else ''
+
+    @staticmethod
+    def _download_kwargs():
+        return dict(username=par.HTTP_DATA_SERVER_LOGIN, password=par.HTTP_DATA_SERVER_PWD,
+                    cache_dir=par.CACHE_DIR, cache_max_bytes=par.CACHE_MAX_BYTES,
+                    range_workers=par.DOWNLOAD_RANGE_WORKERS,
+                    range_min_bytes=par.DOWNLOAD_RANGE_MIN_BYTES,
+                    revalidate=par.DOWNLOAD_REVALIDATE, accept_gzip=par.DOWNLOAD_GZIP,
+                    decompress=par.DOWNLOAD_DECOMPRESS)
+
+    @staticmethod
+    def _list_output(out, dataset_types):
+        # parse the output as a list that matches dataset types provided
         list_out = []
         for dt in dataset_types:
-            if dt not in out.dataset_type:
+            if dt not in out.dataset_type_index:
                 list_out.append(None)
                 continue
-            for i, x, in enumerate(out.dataset_type):
-                if dt == x:
-                    list_out.append(out.data[i])
+            list_out.extend(out.data[i] for i in out.dataset_type_index[dt])
         return list_out
 
     def ls(self, table=None, verbose=False):
@@ -173,7 +668,12 @@ class ONE(OneAbstract):
         list_out = []
         for ind, tab in enumerate(tlist):
             if tab in table:
-                full_out.append(self._alyxClient.get('/' + tab))
+                if self._offline:
+                    full_out.append(self._index.get_table(tab))
+                else:
+                    full_out.append(self._alyxClient.get('/' + tab))
+                    if par.LOCAL_INDEX:
+                        self._index.add_table(tab, full_out[-1])
                 list_out.append([f[field[ind]] for f in full_out[-1]])
         if verbose:
             pprint(list_out)
@@ -209,7 +709,8 @@ class ONE(OneAbstract):
         """
         return self.ls(table='users')
 
-    def search(self, dataset_types=None, users=None, subject='', date_range=None):
+    def search(self, dataset_types=None, users=None, subject='', date_range=None,
+               page_size=None):
         """
         Applies a filter to the sessions (eid) table and returns a list of json dictionaries
          corresponding to sessions.
@@ -222,15 +723,67 @@ class ONE(OneAbstract):
         :type subject: str
         :param date_range: list of 2 strings or list of 2 dates that define the range
         :type date_range: list
+        :param page_size: [None] if specified, sessions are queried by pages of page_size
+         records instead of a single request, see ONE.search_pages
+        :type page_size: int
 
         :return: list of eids
          list of json dictionaries, each entry corresponding to a matching session
         :rtype: list, list
         """
-        # TODO add a lab field in the session table of Alyx to add as a query
+        if page_size:
+            sl, sd = [], []
+            for psl, psd in self.search_pages(dataset_types=dataset_types, users=users,
+                                              subject=subject, date_range=date_range,
+                                              page_size=page_size):
+                sl.extend(psl)
+                sd.extend(psd)
+            return sl, sd
+        if self._offline:
+            ses = self._index.search(**self._search_filters(dataset_types, users, subject,
+                                                            date_range))
+            return [s['url'] for s in ses], ses
+        # implements the loading itself
+        ses = self._alyxClient.get(self._search_url(dataset_types, users, subject, date_range))
+        self._index_sessions(ses)
+        return [s['url'] for s in ses], ses
+
+    def search_pages(self, dataset_types=None, users=None, subject='', date_range=None,
+                     page_size=par.SEARCH_PAGE_SIZE):
+        """
+        Generator form of ONE.search: queries the sessions page by page so that the first
+        results can be processed right away and memory stays bounded on broad queries.
+        Same filters as ONE.search.
+
+        :param page_size: number of sessions per page
+        :type page_size: int
+
+        :return: yields for each page a list of eids and a list of json dictionaries
+        :rtype: generator
+        """
+        if self._offline:
+            ses = self._index.search(**self._search_filters(dataset_types, users, subject,
+                                                            date_range))
+            for i in range(0, len(ses), page_size):
+                yield [s['url'] for s in ses[i:i + page_size]], ses[i:i + page_size]
+            return
+        url = self._search_url(dataset_types, users, subject, date_range)
+        for ses in self._alyxClient.get_pages(url, page_size=page_size):
+            self._index_sessions(ses)
+            yield [s['url'] for s in ses], ses
+
+    @staticmethod
+    def _search_filters(dataset_types, users, subject, date_range):
         # make sure string inputs are interpreted as lists for dataset types and users
         dataset_types = [dataset_types] if isinstance(dataset_types, str) else dataset_types
         users = [users] if isinstance(users, str) else users
+        return dict(dataset_types=dataset_types, users=users, subject=subject,
+                    date_range=date_range)
+
+    def _search_url(self, dataset_types, users, subject, date_range):
+        # TODO add a lab field in the session table of Alyx to add as a query
+        filters = self._search_filters(dataset_types, users, subject, date_range)
+        dataset_types, users = filters['dataset_types'], filters['users']
         # start creating the url
         url = '/sessions?'
         if dataset_types:
@@ -242,9 +795,101 @@ class ONE(OneAbstract):
         # TODO make the daterange more flexible: one date only from, to etc...
         if date_range:
             url = url + '&date_range=' + ','.join(date_range)
-        # implements the loading itself
-        ses = self._alyxClient.get(url)
-        return [s['url'] for s in ses], ses
+        return url
+
+    def prefetch(self, eid, dataset_types=None):
+        """
+        Enqueues the download of datasets on background workers and returns immediately.
+        A later ONE.load of the same datasets waits for the transfers in progress or reads
+        the cached files, so that downloads overlap with computations.
+
+        :param eid: Experiment ID or list of Experiment IDs, see ONE.load
+        :type eid: str, list
+        :param dataset_types: [None]: Alyx dataset types to download, all if None
+        :type dataset_types: list
+
+        :return: future of the sessions query, its result is the list of enqueued urls
+        :rtype: concurrent.futures.Future
+        """
+        with self._lock:
+            if self._prefetch_executor is None:
+                self._prefetch_executor = ThreadPoolExecutor(max_workers=self._max_workers)
+            executor = self._prefetch_executor
+            future = executor.submit(self._prefetch, executor, eid, dataset_types)
+            self._prefetch_queries.add(future)
+        future.add_done_callback(self._prefetch_queries.discard)
+        return future
+
+    def _prefetch(self, executor, eid, dataset_types):
+        outs = self._list_datasets(eid, dataset_types)
+        urls = []
+        for out in outs.values():
+            for url, md5 in zip(out.url, out.md5):
+                with self._lock:
+                    # nothing more is enqueued once the prefetch workers are closed
+                    if executor is not self._prefetch_executor:
+                        return urls
+                    if not url or url in self._inflight:
+                        continue
+                    future = executor.submit(self._fetch_file, url, md5)
+                    self._inflight[url] = future
+                future.add_done_callback(functools.partial(self._prefetch_done, url))
+                urls.append(url)
+        return urls
+
+    def close(self):
+        """
+        Cancels the prefetches that have not started and stops the prefetch workers without
+        waiting for the transfers in progress, so that the interpreter does not wait for the
+        queued downloads at exit. ONE remains usable: a later prefetch starts new workers.
+        """
+        with self._lock:
+            executor, self._prefetch_executor = self._prefetch_executor, None
+            futures = list(self._prefetch_queries) + list(self._inflight.values())
+        for future in futures:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _prefetch_done(self, url, future):
+        # once downloaded the file is read from the cache
+        with self._lock:
+            self._inflight.pop(url, None)
+
+    def pin(self, eid, dataset_types=None, pinned=True):
+        """
+        Pins the files of datasets so that they are never evicted from the local cache.
+        Datasets may be pinned before being downloaded.
+
+        :param eid: Experiment ID or list of Experiment IDs, see ONE.load
+        :type eid: str, list
+        :param dataset_types: [None]: Alyx dataset types to pin, all if None
+        :type dataset_types: list
+        :param pinned: [True] False to unpin the datasets
+        :type pinned: bool
+
+        :return: list of local full paths of the pinned files
+        :rtype: list
+        """
+        outs = self.load(eid, dataset_types=dataset_types, dclass_output=True, dry_run=True)
+        outs = outs.values() if isinstance(outs, dict) else [outs]
+        cache = wc.DownloadCache(par.CACHE_DIR, par.CACHE_MAX_BYTES)
+        files = [wc.cached_file_name(url, cache_dir=par.CACHE_DIR,
+                                     decompress=par.DOWNLOAD_DECOMPRESS)
+                 for out in outs for url in out.url if url]
+        for fil in files:
+            cache.pin(fil, pinned=pinned)
+        return files
+
+    def cache_stats(self):
+        """
+        Reports on the local download cache.
+
+        :return: number of files, total size in bytes, quota, number of cache hits and
+         misses and hit rate
+        :rtype: dict
+        """
+        return wc.DownloadCache(par.CACHE_DIR, par.CACHE_MAX_BYTES).stats()
 
     def session_data_info(self, eid):
         """
@@ -259,4 +904,68 @@ class ONE(OneAbstract):
         :rtype: dataclass SessionInfo
         """
         dses = self.load(eid, dry_run=True)
-        return dses
\ No newline at end of file
+        return dses
+
+
+class AsyncONE:
+    """
+    Asyncio counterpart of ONE: load, search, list and ls are awaitable.
+
+    Metadata requests and file downloads of all concurrent calls run in one shared thread pool
+    of max_concurrency workers over a pooled http session, so that many coroutines can fan out
+    requests without exceeding this limit.
+    """
+
+    def __init__(self, one=None, max_concurrency=par.ASYNC_MAX_CONCURRENCY, **kwargs):
+        """
+        :param one: [None] ONE instance to wrap, if None a ONE instance is created from kwargs
+        :type one: ONE
+        :param max_concurrency: maximum number of concurrent requests and downloads
+        :type max_concurrency: int
+        """
+        self._one = one or ONE(**kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def load(self, eid, dataset_types=None, dclass_output=False, dry_run=False,
+                   lazy=False):
+        """
+        Awaitable ONE.load: each file is downloaded in its own task in the shared pool.
+        Same parameters and output as ONE.load.
+        """
+        outs = await self._run(self._one._list_datasets, eid, dataset_types)
+        if not dry_run and not lazy:
+            urls = [url for out in outs.values() for url in out.url]
+            md5s = [md5 for out in outs.values() for md5 in out.md5]
+            res = await asyncio.gather(*[self._run(self._one._download_file, url, md5)
+                                         for url, md5 in zip(urls, md5s)],
+                                       return_exceptions=True)
+            errors = [r if isinstance(r, Exception) else None for r in res]
+            files = ['' if err else r for r, err in zip(res, errors)]
+            self._one._set_local_paths(list(outs.values()), urls, files, errors)
+        return await self._run(self._one._load_output, eid, outs, dataset_types,
+                               dclass_output=dclass_output, dry_run=dry_run, lazy=lazy)
+
+    async def list(self, eid):
+        """
+        Awaitable ONE.list
+        """
+        return await self._run(self._one.list, eid)
+
+    async def search(self, **kwargs):
+        """
+        Awaitable ONE.search, same parameters
+        """
+        return await self._run(self._one.search, **kwargs)
+
+    async def ls(self, table=None, verbose=False):
+        """
+        Awaitable ONE.ls
+        """
+        return await self._run(self._one.ls, table=table, verbose=verbose)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
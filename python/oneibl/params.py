@@ -12,6 +12,44 @@ HTTP_DATA_SERVER = r'http://ibl.flatironinstitute.com'
 HTTP_DATA_SERVER_LOGIN = 'iblmember'
 HTTP_DATA_SERVER_PWD = sec.HTTP_DATA_SERVER_PWD  # password for data server
 
+# the Alyx authentication token is saved in this file and reused, empty to authenticate
+# at each ONE instantiation
+ALYX_TOKEN_FILE = os.path.join(os.path.expanduser('~'), '.alyx_token.json')
+
+# number of files downloaded concurrently by ONE.load
+DOWNLOAD_MAX_WORKERS = 4
+
+# files larger than DOWNLOAD_RANGE_MIN_BYTES are downloaded over DOWNLOAD_RANGE_WORKERS
+# concurrent connections, each fetching a byte range
+DOWNLOAD_RANGE_WORKERS = 4
+DOWNLOAD_RANGE_MIN_BYTES = 64 * 1024 ** 2
+
+# if True, cached files are revalidated with conditional requests (ETag, Last-Modified)
+# and downloaded again only if they changed on the server
+DOWNLOAD_REVALIDATE = False
+
+# if True, files are transferred gzip compressed when the server supports it
+DOWNLOAD_GZIP = False
+
+# if True, compressed files (.gz, .bz2, .xz) are decompressed in the cache, without the suffix
+DOWNLOAD_DECOMPRESS = False
+
+# maximum number of session ids per Alyx query when loading a list of sessions
+SESSIONS_BATCH_SIZE = 100
+
+# cache size quota in bytes: least recently used files are deleted after downloads, 0 for none
+CACHE_MAX_BYTES = 0
+
+# number of sessions per page in ONE.search_pages
+SEARCH_PAGE_SIZE = 100
+
+# maximum number of concurrent requests and downloads of AsyncONE
+ASYNC_MAX_CONCURRENCY = 16
+
+# if True, the session records and tables fetched from Alyx are saved in an index in the
+# cache directory, so that ONE(offline=True) can answer queries without network access
+LOCAL_INDEX = False
+
 # if empty it will download in the user download directory
 CACHE_DIR = ''
 if CACHE_DIR and not os.path.isdir(CACHE_DIR):
@@ -0,0 +1,109 @@
+"""
+Measures the latency and throughput of ONE.load, ONE.search and ONE.ls against the local
+mock Alyx server, so that performance regressions can be caught offline.
+
+    python -m oneibl.tests.benchmark_one --sessions 50 --latency 0.02 --bandwidth 20e6
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import oneibl.params as par
+import ibllib.webclient as wc
+from oneibl.one import ONE
+from oneibl.tests.mock_alyx import MockAlyxServer
+
+
+def _silent(info):
+    pass
+
+
+def _timeit(func, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return np.array(times)
+
+
+def run(n_sessions=20, dataset_size=1024 * 1024, latency=0.01, bandwidth=None, repeats=5,
+        max_workers=par.DOWNLOAD_MAX_WORKERS, verbose=True):
+    """
+    Runs the benchmark on a fresh mock server and cache directory.
+
+    :param n_sessions: [20] number of sessions of the mock server
+    :param dataset_size: [1MB] size of the dataset files in bytes
+    :param latency: [0.01] server delay per request in seconds
+    :param bandwidth: [None] server throughput per response in bytes per second
+    :param repeats: [5] number of runs of each measure
+    :param max_workers: number of concurrent downloads of ONE
+    :param verbose: [True] prints the results table
+
+    :return: dictionary of results by measure: latencies in seconds (median, p95),
+     operations per second and bytes per second
+    :rtype: dict
+    """
+    cache_dir = tempfile.mkdtemp()
+    params = (par.CACHE_DIR, par.ALYX_TOKEN_FILE)
+    par.CACHE_DIR, par.ALYX_TOKEN_FILE = cache_dir, ''
+    server = MockAlyxServer(n_sessions=n_sessions, dataset_size=dataset_size, latency=latency,
+                            bandwidth=bandwidth)
+    try:
+        server.start()
+        one = ONE(base_url=server.base_url, username='benchmark', password='benchmark',
+                  max_workers=max_workers)
+        # responses are not cached so that each measure queries the server
+        one._alyxClient._cache = wc.ResponseCache(ttl={})
+        eids = list(server.sessions.keys())
+        nbytes = sum(len(s['data_dataset_session_related']) for s in server.sessions.values())
+        nbytes *= dataset_size
+
+        def _load_warm():
+            one.load(eids, dclass_output=True, progress=_silent)
+
+        def _load_cold():
+            shutil.rmtree(cache_dir)
+            _load_warm()
+
+        results = {}
+        measures = [('load cold', _load_cold, nbytes),
+                    ('load warm', _load_warm, 0),
+                    ('search', lambda: one.search(subject='MW49'), 0),
+                    ('ls', one.ls, 0)]
+        for name, func, size in measures:
+            t = _timeit(func, repeats)
+            results[name] = {'median': np.median(t), 'p95': np.percentile(t, 95),
+                             'ops_per_s': 1 / np.mean(t),
+                             'bytes_per_s': size / np.mean(t) if size else None}
+    finally:
+        server.stop()
+        par.CACHE_DIR, par.ALYX_TOKEN_FILE = params
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    if verbose:
+        print('{:<10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'measure', 'median s', 'p95 s', 'op/s', 'MB/s'))
+        for name, r in results.items():
+            print('{:<10} {:>10.4f} {:>10.4f} {:>10.2f} {:>10}'.format(
+                name, r['median'], r['p95'], r['ops_per_s'],
+                '{:.2f}'.format(r['bytes_per_s'] / 1e6) if r['bytes_per_s'] else '-'))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ONE against a local mock Alyx')
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--size', type=int, default=1024 * 1024,
+                        help='dataset file size in bytes')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='server delay per request in seconds')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='server throughput per response in bytes per second')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=par.DOWNLOAD_MAX_WORKERS)
+    args = parser.parse_args()
+    run(n_sessions=args.sessions, dataset_size=args.size, latency=args.latency,
+        bandwidth=args.bandwidth, repeats=args.repeats, max_workers=args.workers)
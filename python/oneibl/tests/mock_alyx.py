@@ -0,0 +1,257 @@
+"""
+Local stand-in for the Alyx REST API and the flat iron data server, to test and benchmark
+ONE and the webclient without network access.
+
+    server = MockAlyxServer(n_sessions=20, latency=0.01, bandwidth=50e6)
+    server.start()
+    one = ONE(base_url=server.base_url, username='test_user', password='pwd')
+    ...
+    server.stop()
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import tempfile
+import datetime
+import threading
+import urllib.parse
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+TOKEN = 'mock-alyx-token'
+DATASET_TYPES = ('spikes.times', 'spikes.clusters', 'clusters.depths', 'trials.intervals')
+USERS = ('olivier', 'nick', 'gaelle')
+SUBJECTS = ('MW49', 'MW53', 'IBL_1')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MockAlyxHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # set by MockAlyxServer on the handler subclass
+    mock = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.mock._write(self.wfile, body)
+
+    def _authorized(self):
+        if self.headers.get('Authorization') == 'Token ' + TOKEN:
+            return True
+        self._send_json({'detail': 'Invalid token.'}, status=401)
+        return False
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.mock._count(self.path)
+        self.mock._wait()
+        if self.path != '/auth-token':
+            self._send_json({'detail': 'Method not allowed.'}, status=405)
+            return
+        data = urllib.parse.parse_qs(body.decode())
+        if data.get('username', [''])[0] and data.get('password', [''])[0]:
+            self._send_json({'token': TOKEN})
+        else:
+            self._send_json({'non_field_errors': ['Unable to log in.']}, status=400)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        self.mock._count(url.path)
+        self.mock._wait()
+        if url.path.startswith('/data/'):
+            self._send_file(url.path[len('/data/'):])
+            return
+        if not self._authorized():
+            return
+        query = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+        path = url.path.rstrip('/')
+        if path in ('/dataset-types', '/users', '/subjects'):
+            self._send_json(self.mock.tables[path[1:]])
+        elif path == '/sessions':
+            self._send_sessions(self.mock.search(**query), query)
+        elif path.startswith('/sessions/') and path[10:] in self.mock.sessions:
+            self._send_json(self.mock.sessions[path[10:]])
+        else:
+            self._send_json({'detail': 'Not found.'}, status=404)
+
+    def _send_sessions(self, sessions, query):
+        # paginates as the django rest framework LimitOffsetPagination
+        if 'limit' not in query:
+            self._send_json(sessions)
+            return
+        limit, offset = int(query['limit']), int(query.get('offset', 0))
+        nxt = None
+        if offset + limit < len(sessions):
+            query = dict(query, offset=offset + limit)
+            nxt = self.mock.base_url + '/sessions?' + urllib.parse.urlencode(query)
+        self._send_json({'count': len(sessions), 'next': nxt, 'previous': None,
+                         'results': sessions[offset:offset + limit]})
+
+    def _send_file(self, rel_path):
+        file_name = os.path.join(self.mock.data_dir, rel_path)
+        if not os.path.isfile(file_name):
+            self._send_json({'detail': 'Not found.'}, status=404)
+            return
+        with open(file_name, 'rb') as f:
+            content = f.read()
+        start = 0
+        rng = self.headers.get('Range', '')
+        if rng.startswith('bytes=') and rng[6:].split('-')[0]:
+            start = int(rng[6:].split('-')[0])
+        if start >= len(content) and start:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(len(content)))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(content) - start))
+        if start:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(content) - 1, len(content)))
+        self.end_headers()
+        self.mock._write(self.wfile, content[start:])
+
+
+class MockAlyxServer:
+    """
+    Serves synthetic sessions on the auth-token, sessions, dataset-types, users and subjects
+    endpoints of the Alyx REST API, and their dataset files under /data, on a local port.
+    """
+
+    def __init__(self, n_sessions=10, dataset_size=1024 * 100, latency=0., bandwidth=None,
+                 seed=0):
+        """
+        :param n_sessions: [10] number of sessions, each with one dataset per DATASET_TYPES
+        :type n_sessions: int
+        :param dataset_size: [102400] approximate size of the npy dataset files in bytes
+        :type dataset_size: int
+        :param latency: [0] delay in seconds added before answering each request
+        :type latency: float
+        :param bandwidth: [None] throughput of each response in bytes per second, unlimited if
+         None
+        :type bandwidth: float
+        :param seed: [0] random seed of the generated sessions and data
+        :type seed: int
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests_count = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.data_dir = tempfile.mkdtemp()
+        self._n_sessions = n_sessions
+        self._dataset_size = dataset_size
+        self._seed = seed
+        self.sessions = {}
+        self.tables = {
+            'dataset-types': [{'name': dt} for dt in DATASET_TYPES],
+            'users': [{'username': u} for u in USERS],
+            'subjects': [{'nickname': s} for s in SUBJECTS],
+        }
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_port)
+
+    def start(self):
+        handler = type('Handler', (_MockAlyxHandler,), {'mock': self})
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._make_sessions()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _make_sessions(self):
+        rs = np.random.RandomState(self._seed)
+        date0 = datetime.date(2018, 5, 1)
+        for i in range(self._n_sessions):
+            eid = str(uuid.UUID(bytes=rs.bytes(16), version=4))
+            subject = SUBJECTS[i % len(SUBJECTS)]
+            date = (date0 + datetime.timedelta(days=i // len(SUBJECTS))).isoformat()
+            rel_dir = '/'.join([subject, date, '001'])
+            os.makedirs(os.path.join(self.data_dir, rel_dir))
+            dsets = []
+            for dt in DATASET_TYPES:
+                did = str(uuid.UUID(bytes=rs.bytes(16), version=4))
+                rel_path = rel_dir + '/' + dt + '.' + did + '.npy'
+                file_name = os.path.join(self.data_dir, rel_path)
+                np.save(file_name, rs.rand(max(self._dataset_size // 8, 1)))
+                with open(file_name, 'rb') as f:
+                    md5 = hashlib.md5(f.read()).hexdigest()
+                dsets.append({'id': did, 'dataset_type': dt, 'md5': str(uuid.UUID(md5)),
+                              'data_url': self.base_url + '/data/' + rel_path})
+            self.sessions[eid] = {
+                'url': self.base_url + '/sessions/' + eid,
+                'subject': subject,
+                'users': [USERS[i % len(USERS)]],
+                'start_time': date + 'T10:00:00',
+                'data_dataset_session_related': dsets,
+            }
+
+    def search(self, id='', dataset_types='', users='', subject='', date_range='', **kwargs):
+        """
+        Filters the sessions as the /sessions endpoint of Alyx
+        """
+        out = []
+        ids = set(id.split(',')) if id else None
+        for eid, ses in self.sessions.items():
+            ses_dtypes = set(d['dataset_type'] for d in ses['data_dataset_session_related'])
+            if ids is not None and eid not in ids:
+                continue
+            if dataset_types and not set(dataset_types.split(',')).issubset(ses_dtypes):
+                continue
+            if users and not set(users.split(',')).issubset(set(ses['users'])):
+                continue
+            if subject and ses['subject'] != subject:
+                continue
+            if date_range:
+                dr = date_range.split(',')
+                if not dr[0] <= ses['start_time'][:10] <= dr[-1]:
+                    continue
+            out.append(ses)
+        return out
+
+    def _count(self, path):
+        with self._lock:
+            self.requests_count[path] = self.requests_count.get(path, 0) + 1
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _write(self, wfile, body, block_sz=64 * 1024):
+        if not self.bandwidth:
+            wfile.write(body)
+            return
+        for i in range(0, len(body), block_sz):
+            wfile.write(body[i:i + block_sz])
+            time.sleep(len(body[i:i + block_sz]) / self.bandwidth)
@@ -1,6 +1,18 @@
 import unittest
+import os
+import asyncio
+import json
+import time
+import tempfile
+import shutil
+from concurrent.futures import Future
 import numpy as np
-from oneibl.one import ONE, SessionInfo
+import pandas as pd
+import oneibl.one
+import oneibl.params as par
+import ibllib.webclient as wc
+from oneibl.one import ONE, AsyncONE, SessionInfo, DatasetProxy, LocalIndex
+from oneibl.tests.mock_alyx import MockAlyxServer
 
 
 class TestLoad(unittest.TestCase):
@@ -28,6 +40,18 @@ class TestLoad(unittest.TestCase):
         d = myone.load(eid, dataset_types=dataset_types, dclass_output=True)
         self.assertTrue(np.all(d.data[0] == t))
 
+    def test_load_lazy(self):
+        # Test the lazy mode: files are downloaded on first access and npy are memory-mapped
+        myone = self.One
+        dataset_types = ['clusters.peakChannel', 'clusters._phy_annotation', 'clusters.probes']
+        eid = '86e27228-8708-48d8-96ed-9aa61ab951db'
+        d = myone.load(eid, dataset_types=dataset_types, dclass_output=True, lazy=True)
+        self.assertTrue(all(isinstance(p, DatasetProxy) for p in d.data))
+        self.assertTrue(all(fil == '' for fil in d.local_path))
+        t = myone.load(eid, dataset_types=dataset_types)
+        self.assertTrue(np.all(np.asarray(d.data[0]) == t[0]))
+        self.assertTrue(d.local_path[0] and isinstance(d.data[0].data, np.memmap))
+
     def test_load_empty(self):
         # Test with a session that doesn't have any dataset on the Flat Iron
         myone = self.One
@@ -57,6 +81,19 @@ class TestLoad(unittest.TestCase):
         a = myone.load(eid)
         self.assertTrue(len(a.data) == 5)
 
+    def test_load_multiple_sessions(self):
+        # Test with a list of sessions: output is a dictionary keyed by eid
+        myone = self.One
+        eids = ['86e27228-8708-48d8-96ed-9aa61ab951db', '3bca3bef-4173-49a3-85d7-596d62f0ae16']
+        dataset_types = ['clusters.peakChannel', 'clusters.probes']
+        d = myone.load(eids, dataset_types=dataset_types)
+        self.assertEqual(set(d.keys()), set(eids))
+        for eid in eids:
+            single = myone.load(eid, dataset_types=dataset_types)
+            self.assertTrue(all(np.all(a == b) for a, b in zip(d[eid], single)))
+        d = myone.load(eids)
+        self.assertTrue(all(isinstance(d[eid], SessionInfo) for eid in eids))
+
     def test_ls(self):
         # Test when the dataset type requested is not unique
         myone = self.One
@@ -101,6 +138,15 @@ class TestLoad(unittest.TestCase):
         sl, sd = myone.search(dataset_types=dtyp)
         self.assertTrue(len(sl) == 1)
 
+    def test_search_pages(self):
+        myone = self.One
+        sl, sd = myone.search(users='olivier')
+        # the paginated search returns the same sessions, page by page
+        pages = list(myone.search_pages(users='olivier', page_size=2))
+        self.assertTrue(all(len(p[0]) <= 2 for p in pages))
+        self.assertEqual(sl, [s for p in pages for s in p[0]])
+        self.assertEqual(myone.search(users='olivier', page_size=2), (sl, sd))
+
     def test_session_data_info(self):
         myone = self.One
         eid = '3bca3bef-4173-49a3-85d7-596d62f0ae16'
@@ -113,5 +159,279 @@ class TestLoad(unittest.TestCase):
         self.assertRaises(FileNotFoundError, self.One.load, eid)
 
 
+class TestLoaders(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_tabular(self):
+        df = pd.DataFrame({'a': [1, 2, 3], 'b': [0.5, np.nan, 2.5], 'c': ['x', None, 'z'],
+                           'd': [True, False, True]})
+        for ext, sep in (('.csv', ','), ('.tsv', '\t')):
+            fil = os.path.join(self.tmp_dir, 'table' + ext)
+            df.to_csv(fil, sep=sep, index=False)
+            out = oneibl.one._load_file(fil)
+            self.assertTrue(out.equals(pd.read_csv(fil, sep=sep)))
+            self.assertTrue(os.path.exists(fil + '.npz'))
+            # second load reads the parsed binary cache, which holds no pickled objects
+            self.assertTrue(oneibl.one._load_file(fil).equals(out))
+            self.assertTrue(oneibl.one._read_table_npz(fil + '.npz').equals(out))
+            self.assertEqual(os.listdir(self.tmp_dir).count('table' + ext + '.npz'), 1)
+
+    def test_load_malformed(self):
+        fil = os.path.join(self.tmp_dir, 'ragged.csv')
+        with open(fil, 'w') as f:
+            f.write('a,b\n1,2\n3,4,5,6\n')
+        self.assertEqual(oneibl.one._load_file(fil), [])
+
+    def test_load_json(self):
+        fil = os.path.join(self.tmp_dir, 'settings.json')
+        with open(fil, 'w') as f:
+            f.write(json.dumps({'a': 1}) + '\n' + json.dumps({'b': 2}) + '\n')
+        self.assertEqual(oneibl.one._load_file(fil), [{'a': 1}, {'b': 2}])
+
+    def test_register_loader(self):
+        fil = os.path.join(self.tmp_dir, 'file.txt')
+        with open(fil, 'w') as f:
+            f.write('toto')
+        self.assertEqual(oneibl.one._load_file(fil), [])
+        oneibl.one.register_loader('.txt', lambda fn, mmap_mode=None: open(fn).read())
+        try:
+            self.assertEqual(oneibl.one._load_file(fil), 'toto')
+        finally:
+            oneibl.one.LOADERS.pop('.txt')
+
+
+class TestOffline(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self._cache_dir_par = par.CACHE_DIR
+        par.CACHE_DIR = self.cache_dir
+        self.eid = '86e27228-8708-48d8-96ed-9aa61ab951db'
+        url = 'http://data.server/Subjects/MW49/2018-05-11/1/spikes.times.npy'
+        ses = {'url': 'http://alyx.server/sessions/' + self.eid, 'users': ['olivier'],
+               'subject': 'MW49', 'start_time': '2018-05-11T10:00:00',
+               'data_dataset_session_related': [
+                   {'dataset_type': 'spikes.times', 'data_url': url, 'id': 'ds1'},
+                   {'dataset_type': 'spikes.clusters', 'data_url': None, 'id': 'ds2'}]}
+        LocalIndex(self.cache_dir).add_sessions([ses])
+        file_name = wc.cached_file_name(url, cache_dir=self.cache_dir)
+        os.makedirs(os.path.dirname(file_name))
+        np.save(file_name, np.arange(5))
+        self.One = ONE(offline=True)
+
+    def tearDown(self):
+        par.CACHE_DIR = self._cache_dir_par
+        shutil.rmtree(self.cache_dir)
+
+    def test_load(self):
+        st, sc = self.One.load(self.eid, dataset_types=['spikes.times', 'spikes.clusters'])
+        self.assertTrue(np.all(st == np.arange(5)))
+        self.assertEqual(self.One.list(self.eid), ['spikes.times'])
+        d = self.One.load(self.eid, dataset_types=['spikes.clusters', 'spikes.times'],
+                          dclass_output=True)
+        self.assertEqual(d.dataset_type_index, {'spikes.clusters': [0], 'spikes.times': [1]})
+        self.assertRaises(FileNotFoundError, self.One.load,
+                          'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee')
+
+    def test_load_unparsable(self):
+        # a malformed file loads as an empty list, the other datasets of the session load
+        url = 'http://data.server/Subjects/MW49/2018-05-11/1/_ibl_rig.settings.json'
+        ses = LocalIndex(self.cache_dir).get_sessions([self.eid])[self.eid]
+        ses['data_dataset_session_related'].append(
+            {'dataset_type': 'rig.settings', 'data_url': url, 'id': 'ds3'})
+        LocalIndex(self.cache_dir).add_sessions([ses])
+        with open(wc.cached_file_name(url, cache_dir=self.cache_dir), 'w') as f:
+            f.write('{"a": 1,\n')
+        st, rs = self.One.load(self.eid, dataset_types=['spikes.times', 'rig.settings'])
+        self.assertTrue(np.all(st == np.arange(5)))
+        self.assertEqual(rs, [])
+
+    def test_async(self):
+        aone = AsyncONE(one=self.One, max_concurrency=4)
+
+        async def main():
+            return await asyncio.gather(aone.load(self.eid, dataset_types='spikes.times'),
+                                        aone.search(subject='MW49'))
+        loop = asyncio.new_event_loop()
+        try:
+            (st,), (sl, sd) = loop.run_until_complete(main())
+        finally:
+            loop.close()
+            aone.close()
+        self.assertTrue(np.all(st == np.arange(5)))
+        self.assertEqual(len(sl), 1)
+
+    def test_prefetch(self):
+        future = self.One.prefetch([self.eid])
+        self.assertEqual(len(future.result()), 1)
+        st, = self.One.load(self.eid, dataset_types=['spikes.times'])
+        self.assertTrue(np.all(st == np.arange(5)))
+
+    def test_search(self):
+        sl, sd = self.One.search(users='olivier', dataset_types=['spikes.times'],
+                                 date_range=['2018-05-01', '2018-05-31'])
+        self.assertEqual(len(sl), 1)
+        sl, sd = self.One.search(subject='MW50')
+        self.assertEqual(len(sl), 0)
+        pages = list(self.One.search_pages(subject='MW49', page_size=1))
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(pages[0], self.One.search(subject='MW49'))
+
+
+class TestMockAlyx(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self._par = (par.CACHE_DIR, par.ALYX_TOKEN_FILE, par.LOCAL_INDEX)
+        par.CACHE_DIR = self.cache_dir
+        par.ALYX_TOKEN_FILE = os.path.join(self.cache_dir, 'token.json')
+        self.server = MockAlyxServer(n_sessions=6, dataset_size=1024, latency=0.001).start()
+        self.One = ONE(base_url=self.server.base_url, username='test_user', password='pwd')
+
+    def tearDown(self):
+        self.server.stop()
+        par.CACHE_DIR, par.ALYX_TOKEN_FILE, par.LOCAL_INDEX = self._par
+        shutil.rmtree(self.cache_dir)
+
+    def test_load(self):
+        eids = list(self.server.sessions.keys())
+        out = self.One.load(eids[:3], dataset_types=['spikes.times', 'clusters.depths'])
+        self.assertEqual(len(out), 3)
+        self.assertTrue(all(isinstance(v[0], np.ndarray) for v in out.values()))
+        self.assertEqual(self.server.requests_count['/sessions'], 1)
+        self.assertEqual(len(self.One.list(eids[0])), 4)
+
+    def test_load_error(self):
+        eid = list(self.server.sessions.keys())[0]
+        url = self.server.sessions[eid]['data_dataset_session_related'][0]['data_url']
+        # the served file does not match the md5 of the dataset record anymore
+        with open(os.path.join(self.server.data_dir, url.split('/data/')[1]), 'ab') as f:
+            f.write(b'corrupted')
+        with self.assertRaises(IOError) as cm:
+            self.One.load(eid)
+        self.assertIn(url, str(cm.exception))
+        # only the corrupted file is reported, the other files of the session are loaded
+        others = self.server.sessions[eid]['data_dataset_session_related'][1:]
+        self.assertFalse(any(d['data_url'] in str(cm.exception) for d in others))
+
+    def test_load_lazy(self):
+        eid = list(self.server.sessions.keys())[0]
+        path = self.server.sessions[eid]['data_dataset_session_related'][0]['data_url']
+        path = path[len(self.server.base_url):]
+        st, sc = self.One.load(eid, dataset_types=['spikes.times', 'spikes.clusters'], lazy=True)
+        self.assertTrue(isinstance(st, DatasetProxy))
+        self.assertNotIn(path, self.server.requests_count)
+        # the file is downloaded on first access only, and memory-mapped
+        self.assertTrue(isinstance(st.data, np.memmap))
+        self.assertEqual(self.server.requests_count[path], 1)
+        self.assertTrue(np.all(st + 1 == np.asarray(st) + 1))
+        self.assertTrue(np.all(1 - st == 1 - np.asarray(st)))
+        self.assertTrue(np.all((st > 0.5) == (np.asarray(st) > 0.5)))
+        self.assertEqual(self.server.requests_count[path], 1)
+        self.assertNotIn(sc.url[len(self.server.base_url):], self.server.requests_count)
+
+    def test_local_index(self):
+        index_dir = os.path.join(self.cache_dir, '.one_index')
+        sl, sd = self.One.search(subject='MW49')
+        self.assertFalse(os.path.exists(index_dir))
+        par.LOCAL_INDEX = True
+        self.One.search(subject='MW49')
+        self.One.ls(table='users')
+        offline = ONE(offline=True)
+        self.assertEqual(offline.search(subject='MW49'), (sl, sd))
+        self.assertEqual(offline.ls(table='users'), self.One.ls(table='users'))
+        # unchanged records are not written again
+        files = [os.path.join(index_dir, 'sessions', eid[-36:] + '.json') for eid in sl]
+        mtimes = [os.stat(f).st_mtime_ns for f in files]
+        os.utime(files[0], ns=(0, 0))
+        self.One.search(subject='MW49')
+        self.assertEqual(os.stat(files[0]).st_mtime_ns, 0)
+        self.assertEqual([os.stat(f).st_mtime_ns for f in files[1:]], mtimes[1:])
+
+    def test_async(self):
+        eids = list(self.server.sessions.keys())
+        aone = AsyncONE(one=self.One, max_concurrency=4)
+        aac = wc.AsyncAlyxClient(alyx_client=self.One._alyxClient, max_concurrency=4)
+
+        async def pages():
+            return [p async for p in aac.get_pages('/sessions?subject=MW49', page_size=1)]
+
+        async def main():
+            return await asyncio.gather(
+                aone.load(eids[0], dataset_types=['spikes.times', 'clusters.depths']),
+                aone.load(eids[1:4], dataset_types='spikes.times'),
+                aone.search(subject='MW49'), pages(), aac.get('/users'))
+        loop = asyncio.new_event_loop()
+        try:
+            one_ses, many_ses, (sl, sd), ses_pages, users = loop.run_until_complete(main())
+        finally:
+            loop.close()
+            aone.close()
+            aac.close()
+        self.assertTrue(all(isinstance(d, np.ndarray) for d in one_ses))
+        expected = self.One.load(eids[1:4], dataset_types='spikes.times')
+        self.assertEqual(set(many_ses.keys()), set(eids[1:4]))
+        self.assertTrue(all(np.all(many_ses[e][0] == expected[e][0]) for e in eids[1:4]))
+        self.assertEqual(len(sl), 2)
+        self.assertEqual([s['url'] for p in ses_pages for s in p], sl)
+        self.assertEqual(len(users), 3)
+
+    def test_prefetch(self):
+        # each file takes about 0.2 s to transfer
+        self.server.bandwidth = 5000
+        eid = list(self.server.sessions.keys())[0]
+        url, = self.One.prefetch(eid, dataset_types=['spikes.times']).result()
+        path = url[len(self.server.base_url):]
+        # load waits for the transfer in progress rather than starting another one
+        self.assertIn(url, self.One._inflight)
+        st, = self.One.load(eid, dataset_types=['spikes.times'])
+        self.assertTrue(isinstance(st, np.ndarray))
+        self.assertEqual(self.server.requests_count[path], 1)
+
+    def test_prefetch_close(self):
+        self.server.bandwidth = 5000
+        one = ONE(base_url=self.server.base_url, username='test_user', password='pwd',
+                  max_workers=1)
+        urls = one.prefetch(list(self.server.sessions.keys())).result()
+        t0 = time.time()
+        one.close()
+        self.assertLess(time.time() - t0, 0.1)
+        self.assertLessEqual(len(one._inflight), 1)
+        # only the transfer in progress completes, the queued ones are cancelled
+        time.sleep(0.5)
+        paths = [url[len(self.server.base_url):] for url in urls]
+        self.assertLessEqual(sum(p in self.server.requests_count for p in paths), 2)
+        self.assertEqual(len(one.prefetch(list(self.server.sessions.keys())[0]).result()), 4)
+        one.close()
+
+    def test_prefetch_cancelled(self):
+        # a load waiting for a prefetch cancelled by ONE.close downloads the file itself
+        eid = list(self.server.sessions.keys())[0]
+        urls = [d['data_url'] for d in self.server.sessions[eid]['data_dataset_session_related']]
+        for url in urls[:2]:
+            future = Future()
+            future.cancel()
+            self.One._inflight[url] = future
+        st, = self.One.load(eid, dataset_types=['spikes.times'])
+        self.assertTrue(isinstance(st, np.ndarray))
+        sc, = self.One.load(eid, dataset_types=['spikes.clusters'], lazy=True)
+        self.assertTrue(isinstance(sc.data, np.ndarray))
+
+    def test_search_ls(self):
+        sl, sd = self.One.search(subject='MW49')
+        self.assertEqual(len(sl), 2)
+        pages = list(self.One.search_pages(users='olivier', page_size=1))
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(len(self.One.ls()[0]), 3)
+        # the token is reused by the next instance
+        ONE(base_url=self.server.base_url, username='test_user', password='pwd')
+        self.assertEqual(self.server.requests_count['/auth-token'], 1)
+
+
 if __name__ == '__main__':
     unittest.main()